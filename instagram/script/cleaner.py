@@ -0,0 +1,58 @@
+import re
+from typing import Dict, Iterable, List
+
+# the patterns removed from a lowercased comment before spaCy sees it, in the
+# order they used to be applied one after another
+CLEANING_RULES = {
+    "youtube": {
+        "hashtag": r"#\w+",
+        "mention": r"@\w+",
+        "laughter": r"\b[kK]+\b",
+    },
+    "instagram": {
+        "hashtag": r"#\w+",
+        "mention": r"@\w+",
+        "laughter": r"(?:ha)+|k+",
+    },
+}
+
+WHITESPACE = re.compile(r"\s+")
+TOKEN = re.compile(r"[\w-]+")
+
+def get_cleaning_pattern(platform: str,
+                         rules: Dict[str, Dict[str, str]]=CLEANING_RULES) -> re.Pattern:
+    """Compile all removal rules of a platform into a single alternation.
+
+    The hashtag and mention rules come first and begin at "#" and "@", which
+    the laughter rule can't match, so one left to right scan removes the same
+    text as running the substitutions one after another.
+    """
+    return re.compile("|".join(f"(?:{pattern})"
+                               for pattern in rules[platform].values()))
+
+def clean_texts(texts: Iterable[str], platform: str) -> List[str]:
+    """Lowercase the texts, remove hashtags, mentions and laughter and
+    collapse the whitespace, all in one pass per text."""
+    pattern = get_cleaning_pattern(platform)
+    return [WHITESPACE.sub(" ", pattern.sub("", text.lower())).strip()
+            for text in texts]
+
+def normalize_texts(texts: Iterable[str],
+                    normalized_words: Dict[str, str]) -> List[str]:
+    """Replace whole tokens of running text by their normalized spelling.
+
+    Every token costs one dict lookup, so the time doesn't depend on how many
+    words are normalized, and words that merely contain a key (e.g. "mae" in
+    "maestro") are left alone.
+    """
+    lookup = normalized_words.get
+    return [TOKEN.sub(lambda match: lookup(match.group(), match.group()), text)
+            for text in texts]
+
+def tidy_texts(texts: Iterable[str],
+               normalized_words: Dict[str, str] | None=None) -> List[str]:
+    """Lowercase the joined lemmas, collapse their whitespace and normalize
+    their spelling in one pass."""
+    lookup = (normalized_words or {}).get
+    return [" ".join([lookup(token, token) for token in text.lower().split()])
+            for text in texts]
@@ -0,0 +1,56 @@
+import os
+import json
+import uuid
+from typing import Dict
+
+INSTAGRAM_DATA_DIR = f"/home/{os.getlogin()}/Desktop/bachelor_thesis" \
+                      "/instagram/data"
+
+# the stages hand over single files, each with its version and the version of
+# the file it was built from in <name>.dataset.json next to it, like the
+# _dataset.json of the YouTube datasets
+
+def get_file_path(name: str) -> str:
+    return f"{INSTAGRAM_DATA_DIR}/{name}"
+
+def get_info_path(name: str) -> str:
+    return f"{get_file_path(name)}.dataset.json"
+
+def get_file_info(name: str) -> Dict | None:
+    """Return the version of a file and the version of the file it was built
+    from, None for files written before this was recorded."""
+    if not os.path.exists(get_info_path(name)):
+        return None
+    with open(get_info_path(name), "r") as file:
+        return json.load(file)
+
+def delete_file_info(name: str) -> None:
+    """Called before a file is written, so that a crash leaves it outdated
+    instead of passing for current."""
+    if os.path.exists(get_info_path(name)):
+        os.remove(get_info_path(name))
+
+def write_file_info(name: str, source: str | None=None) -> None:
+    """Give the file <name>, once completely written, a new version, recorded
+    together with the current version of the file <source> it was built
+    from."""
+    source_info = get_file_info(source) if source else None
+    with open(get_info_path(name), "w") as file:
+        json.dump({"version": uuid.uuid4().hex,
+                   "source": source,
+                   "source_version": source_info and source_info["version"]},
+                  file, indent=4)
+
+def is_current(name: str) -> bool:
+    """Whether a file exists and was built from the version of its source
+    that exists now, and that source the same way."""
+    info = get_file_info(name) if os.path.exists(get_file_path(name)) else None
+    if info is None:
+        return False
+    if info["source"] is None:
+        return True
+    source_info = get_file_info(info["source"]) \
+                  if os.path.exists(get_file_path(info["source"])) else None
+    return source_info is not None \
+           and source_info["version"] == info["source_version"] \
+           and is_current(info["source"])
@@ -0,0 +1,198 @@
+import os
+import sys
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+import numpy as np
+import torch
+from sentence_transformers import SentenceTransformer
+from tqdm import tqdm
+
+EMBEDDING_MODEL = "paraphrase-multilingual-MiniLM-L12-v2"
+# torch: the model as it is, on the GPU if there is one
+# int8: dynamically quantized linear layers, CPU only
+# onnx: ONNX Runtime, CPU only, needs sentence-transformers>=3.2 and
+#       onnxruntime (pip install "sentence-transformers[onnx]")
+EMBEDDING_BACKENDS = ["torch", "int8", "onnx"]
+# small batches of short comments don't keep more threads busy, more
+# processes with a few threads each use the cores better
+THREADS_PER_PROCESS = 4
+# padded tokens per batch, a batch of short comments holds many more of them
+# than the old fixed 32 while one of 128 token comments holds 64
+TOKEN_BUDGET = 8192
+MAX_BATCH_SIZE = 1024
+
+# loaded once per worker process by <init_embedding_worker>
+_worker_model = None
+
+def get_device() -> str:
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+def get_backend(backend: str="auto") -> str:
+    """The original model on a GPU, otherwise the int8 model on the CPU."""
+    if backend == "auto":
+        return "torch" if get_device() == "cuda" else "int8"
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend [{backend}], choose " \
+                         f"one of {EMBEDDING_BACKENDS}.")
+    return backend
+
+def get_embedding_name(backend: str="auto") -> str:
+    """Name the embeddings of a backend are cached under. The ONNX graph
+    computes the same embeddings as torch, the int8 ones differ slightly and
+    are kept apart so that the two are never mixed in one model."""
+    backend = get_backend(backend)
+    return f"{EMBEDDING_MODEL}-int8" if backend == "int8" else EMBEDDING_MODEL
+
+def load_embedding_model(backend: str="auto") -> SentenceTransformer:
+    backend = get_backend(backend)
+
+    if backend == "onnx":
+        return SentenceTransformer(EMBEDDING_MODEL, device="cpu", backend="onnx")
+
+    if backend == "int8":
+        embedding_model = SentenceTransformer(EMBEDDING_MODEL, device="cpu")
+        torch.quantization.quantize_dynamic(embedding_model,
+                                            {torch.nn.Linear},
+                                            dtype=torch.qint8,
+                                            inplace=True)
+        return embedding_model
+
+    return SentenceTransformer(EMBEDDING_MODEL, device=get_device())
+
+def get_model_device(embedding_model: SentenceTransformer,
+                     backend: str="auto") -> str:
+    """Device type <embedding_model> runs on. The int8 and ONNX models are
+    always on the CPU, and the ONNX one has no torch parameters to tell."""
+    if get_backend(backend) != "torch":
+        return "cpu"
+    try:
+        return embedding_model.device.type
+    except (AttributeError, StopIteration):
+        return "cpu"
+
+def get_n_process() -> int:
+    if hasattr(os, "sched_getaffinity"):
+        cores = len(os.sched_getaffinity(0))
+    else:
+        cores = os.cpu_count() or 1
+    return max(1, cores // THREADS_PER_PROCESS)
+
+def init_embedding_worker(backend: str) -> None:
+    global _worker_model
+    torch.set_num_threads(THREADS_PER_PROCESS)
+    _worker_model = load_embedding_model(backend)
+
+def get_token_lengths(embedding_model: SentenceTransformer,
+                      texts: List[str]) -> np.ndarray:
+    """Number of tokens of every text as the model sees it, i.e. with the
+    special tokens and cut at max_seq_length."""
+    encoded = embedding_model.tokenizer(texts,
+                                        truncation=True,
+                                        max_length=embedding_model.max_seq_length)
+    return np.fromiter((len(ids) for ids in encoded["input_ids"]),
+                       dtype=np.int64, count=len(texts))
+
+def get_length_batches(lengths: np.ndarray,
+                       token_budget: int=TOKEN_BUDGET,
+                       max_batch_size: int=MAX_BATCH_SIZE) -> List[np.ndarray]:
+    """Group the text indices by length into batches whose padded size, the
+    batch size times its longest text, stays within <token_budget>.
+
+    The indices are visited shortest first, so every text added is the new
+    longest one of its batch and little of any batch is padding.
+    """
+    batches = list()
+    batch_start = 0
+    order = np.argsort(lengths, kind="stable")
+    for position, idx in enumerate(order):
+        batch_size = position - batch_start + 1
+        if batch_size > 1 and (batch_size > max_batch_size
+                               or batch_size * lengths[idx] > token_budget):
+            batches.append(order[batch_start:position])
+            batch_start = position
+    if batch_start < len(order):
+        batches.append(order[batch_start:])
+    return batches
+
+def encode_bucketed(embedding_model: SentenceTransformer,
+                    texts: List[str],
+                    token_budget: int=TOKEN_BUDGET,
+                    show_progress_bar: bool=True) -> np.ndarray:
+    """Encode <texts> in length-bucketed batches sized to <token_budget> and
+    return the embeddings in the order of <texts>, shape (0, dim) if there
+    are none."""
+    embeddings = np.empty((len(texts),
+                           embedding_model.get_sentence_embedding_dimension()),
+                          dtype=np.float32)
+    if not texts:
+        return embeddings
+    batches = get_length_batches(get_token_lengths(embedding_model, texts),
+                                 token_budget)
+    for batch in tqdm(batches, desc="encode_bucketed", 
+                      disable=not show_progress_bar):
+        embeddings[batch] = embedding_model.encode([texts[idx] for idx in batch],
+                                                   batch_size=len(batch))
+    return embeddings
+
+def encode_chunk(texts: List[str], token_budget: int) -> np.ndarray:
+    return encode_bucketed(_worker_model, texts, token_budget, 
+                           show_progress_bar=False)
+
+def encode(embedding_model: SentenceTransformer,
+           texts: List[str],
+           backend: str="auto",
+           token_budget: int=TOKEN_BUDGET,
+           n_process: int | None=None,
+           chunk_size: int=10000) -> np.ndarray:
+    """Encode <texts> with <embedding_model>, on the CPU split into chunks
+    over <n_process> processes that load the model of <backend> once each.
+    The embeddings are returned in the order of <texts>."""
+    n_process = n_process or get_n_process()
+    if get_model_device(embedding_model, backend) != "cpu" or n_process == 1 \
+       or len(texts) <= chunk_size:
+        return encode_bucketed(embedding_model, texts, token_budget)
+
+    chunks = [texts[start:start + chunk_size]
+              for start in range(0, len(texts), chunk_size)]
+    # forking a process that already ran torch can deadlock its thread pool
+    with ProcessPoolExecutor(max_workers=n_process,
+                             mp_context=multiprocessing.get_context("spawn"),
+                             initializer=init_embedding_worker,
+                             initargs=(get_backend(backend),)) as executor:
+        results = executor.map(encode_chunk, chunks, [token_budget] * len(chunks))
+        embeddings = list(tqdm(results, total=len(chunks), desc="encode"))
+    return np.concatenate(embeddings)
+
+def benchmark(texts: List[str], backend: str="auto") -> None:
+    """Compare the fixed batches of 32 texts in their original order with
+    the length-bucketed batches on the same texts and model."""
+    embedding_model = load_embedding_model(backend)
+    lengths = get_token_lengths(embedding_model, texts)
+    print(f"[{len(texts)}] texts, tokens: median [{np.median(lengths):.0f}] " \
+          f"p90 [{np.percentile(lengths, 90):.0f}] max [{lengths.max()}], " \
+          f"backend [{get_backend(backend)}]")
+
+    start = time.perf_counter()
+    fixed = embedding_model.encode(texts, batch_size=32)
+    fixed_elapsed = time.perf_counter() - start
+    print(f"batch_size=32:         [{len(texts) / fixed_elapsed:.0f}] texts/s")
+
+    start = time.perf_counter()
+    bucketed = encode_bucketed(embedding_model, texts, show_progress_bar=False)
+    bucketed_elapsed = time.perf_counter() - start
+    print(f"token_budget={TOKEN_BUDGET}: [{len(texts) / bucketed_elapsed:.0f}] " \
+          f"texts/s ({fixed_elapsed / bucketed_elapsed:.2f}x)")
+    print(f"max abs difference: [{np.abs(fixed - bucketed).max():.2e}]")
+
+if __name__ == "__main__":
+    # e.g. python embedding.py 50000 int8, on a sample of the real comments
+    import pandas as pd
+
+    sample_size = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    comments = pd.read_pickle(f"/home/{os.getlogin()}/Desktop/bachelor_thesis" \
+                              "/instagram/data/data_preprocessed.pkl")["comment"]
+    sample = comments.sample(min(sample_size, len(comments)), random_state=42)
+    benchmark(sample.astype(str).tolist(), 
+              backend=sys.argv[2] if len(sys.argv) > 2 else "auto")
@@ -1,40 +1,119 @@
 import os
 import json
+from typing import Dict, Iterable, Iterator
 import pandas as pd
-# from bachelorarbeit.youtube.script.functions import get_youtube_data
+import pyarrow as pa
+import pyarrow.parquet as pq
+from dataset import delete_file_info, write_file_info
 
-def main():
-    with open(f"/home/{os.getlogin()}/Desktop/bachelor_thesis/instagram/data/data.json", 'r') as file: 
-        docs = json.load(file) 
-    all_comments = list()
-    year = ("2020", "2021", "2022")
+INSTAGRAM_DATA_DIR = f"/home/{os.getlogin()}/Desktop/bachelor_thesis" \
+                      "/instagram/data"
+YEARS = ["2020", "2021", "2022"]
+MIN_POST_COMMENTS = 20
+BATCH_SIZE = 200000
+FILTERED_SCHEMA = pa.schema([(column, pa.string()) 
+                             for column in ["url", "channel", "date", "comment"]])
+
+def iter_json_array(filename: str, chunk_size: int=1 << 20) -> Iterator[Dict]:
+    """Yield the elements of a top-level JSON array without loading the whole
+    file into memory."""
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    started = False
+
+    with open(filename, "r") as file:
+        while True:
+            chunk = file.read(chunk_size)
+            buffer = buffer[position:] + chunk
+            position = 0
+
+            while True:
+                while position < len(buffer) and buffer[position] in " \t\r\n,":
+                    position += 1
+                if not started and position < len(buffer):
+                    if buffer[position] != "[":
+                        raise ValueError(f"{filename} does not contain a JSON array.")
+                    started = True
+                    position += 1
+                    continue
+                if position < len(buffer) and buffer[position] == "]":
+                    return
+                try:
+                    element, position = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    break
+                yield element
+
+            if not chunk:
+                if buffer[position:].strip():
+                    raise ValueError(f"{filename} ended in the middle of an element.")
+                return
+
+def iter_comment_batches(docs: Iterable[Dict],
+                         batch_size: int=BATCH_SIZE) -> Iterator[pd.DataFrame]:
+    """Flatten posts and comments into DataFrames of about <batch_size> rows,
+    together with the post date and comment count the filters need."""
+    columns = ["url", "channel", "post_date", "post_comment_count", "date",
+               "comment"]
+    batch = {column: [] for column in columns}
 
     for doc in docs:
         post_url = doc["post_url"].split("/")[-2]
-        post_user = doc["post_user"]
-        post_date = doc["post_date"]
         post_comments = doc["post_comments"]
 
-        if post_date.startswith(year) and len(post_comments) >= 20:
-            for comment in post_comments:
-                comment_text = comment["comment"]
-                comment_date = comment["comment_date"][:10]
+        for comment in post_comments:
+            batch["url"].append(post_url)
+            batch["channel"].append(doc["post_user"])
+            batch["post_date"].append(doc["post_date"])
+            batch["post_comment_count"].append(len(post_comments))
+            batch["date"].append(comment["comment_date"])
+            batch["comment"].append(comment["comment"])
+
+        if len(batch["comment"]) >= batch_size:
+            yield pd.DataFrame(batch)
+            batch = {column: [] for column in columns}
 
-                if comment_date.startswith(year):
-                    all_comments.append(
-                        (post_url, post_user, comment_date, comment_text)
-                    )
+    if batch["comment"]:
+        yield pd.DataFrame(batch)
 
-    df = pd.DataFrame(all_comments, 
-                      columns=["url", "channel", "date", "comment"])
-    df.to_pickle(f"/home/{os.getlogin()}/Desktop/bachelor_thesis/instagram/data/data_filtered.pkl")
+def filter_comments(df: pd.DataFrame) -> pd.DataFrame:
+    """Keep comments from the given years on posts from these years with
+    enough comments."""
+    mask = (
+        df["post_date"].str[:4].isin(YEARS)
+        & (df["post_comment_count"] >= MIN_POST_COMMENTS)
+        & df["date"].str[:4].isin(YEARS)
+    )
+    df = df.loc[mask, ["url", "channel", "date", "comment"]]
+    return df.assign(date=df["date"].str[:10])
+
+def main():
+    """Filter the posts batch by batch into data_filtered.parquet, only one
+    batch is held in memory. The file is written next to the old one and
+    swapped in when complete, also when no comment passed the filters."""
+    docs = iter_json_array(f"{INSTAGRAM_DATA_DIR}/data.json")
+    file_path = f"{INSTAGRAM_DATA_DIR}/data_filtered.parquet"
+    channel_counts = pd.Series(dtype="int64")
+    year_counts = pd.Series(dtype="int64")
 
+    delete_file_info("data_filtered.parquet")
+    with pq.ParquetWriter(f"{file_path}.tmp", FILTERED_SCHEMA) as writer:
+        for batch in iter_comment_batches(docs):
+            df = filter_comments(batch)
+            writer.write_table(pa.Table.from_pandas(df, schema=FILTERED_SCHEMA,
+                                                    preserve_index=False))
+            channel_counts = channel_counts.add(df["channel"].value_counts(),
+                                                fill_value=0)
+            year_counts = year_counts.add(df["date"].str[:4].value_counts(),
+                                          fill_value=0)
+    os.replace(f"{file_path}.tmp", file_path)
+    write_file_info("data_filtered.parquet")
 
-    df["date_year"] = df["date"].apply(lambda x: x.split("-")[0])
-    print(df[["channel"]].value_counts())
-    print(df[["date_year"]].value_counts())
+    print(channel_counts.astype(int).sort_values(ascending=False))
+    print(year_counts.astype(int).sort_index())
 
 if __name__ == "__main__":
     print("Filtering comments... ", end="")
     main()
-    print("OK")
\ No newline at end of file
+    print("OK")
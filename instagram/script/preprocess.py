@@ -1,22 +1,26 @@
 import time
 import os
-import re
-from typing import List
 import pandas as pd
 import numpy as np
 import spacy
+from spacy.language import Language
+from spacy.tokens import Token
 from tqdm import tqdm
+from cleaner import clean_texts, normalize_texts, tidy_texts
+from dataset import is_current
 from stopwords import get_stopwords, get_normalized_words
 
 INSTAGRAM_DATA_DIR = f"/home/{os.getlogin()}/Desktop/bachelor_thesis" \
                       "/instagram/data"
 STOPWORDS = get_stopwords()
+# lexeme ID => whether the word passes <is_valid_lexeme>
+VALID_LEXEMES = dict()
+# components the lemmas need, the lemmatizer of pt_core_news_lg may listen to
+# tok2vec depending on the model version
+LEMMA_PIPES = ["tok2vec", "lemmatizer", "trainable_lemmatizer"]
 
-def remove_hashtag(text): return re.sub('#\w+', '', text).strip()
-def remove_mention(text): return re.sub("@\w+", '', text).strip()
-def remove_laughter(text): return re.sub(r'(ha)+|(k)+', '', text).strip()
-
-def is_valid_token(token: str) -> bool:
+def is_valid_lexeme(token: Token) -> bool:
+    """Checks that only depend on the word itself, not on its context."""
     return (
         not token.is_stop
         and not token.is_space
@@ -27,41 +31,104 @@ def is_valid_token(token: str) -> bool:
         and not token.like_num
         and token.is_alpha
         and token.text not in STOPWORDS
-        and len(token.lemma_) >= 3
     ) 
 
-def spacy_preprocessing(df: pd.DataFrame, docs: List[str]) -> pd.DataFrame:
-    for idx, doc in enumerate(tqdm(docs, desc="spacy_preprocessing")):
-        processed_text = [token.lemma_ for token in doc if is_valid_token(token)]
-        df.iat[idx, 3] = " ".join(processed_text) if processed_text else ""
-        
+def is_valid_token(token: Token) -> bool:
+    """The lexeme checks are done once per vocabulary entry and cached by the
+    lexeme ID, only the lemma length is checked for every token."""
+    valid = VALID_LEXEMES.get(token.orth)
+    if valid is None:
+        valid = VALID_LEXEMES[token.orth] = is_valid_lexeme(token)
+    return valid and len(token.lemma_) >= 3
+
+def get_n_process(memory_per_process: float=1.5) -> int:
+    """Return how many spaCy processes this machine can run: one per usable
+    core, but no more than fit in memory with a copy of pt_core_news_lg each.
+
+    :memory_per_process: GiB needed by one process
+    """
+    if hasattr(os, "sched_getaffinity"):
+        cores = len(os.sched_getaffinity(0))
+    else:
+        cores = os.cpu_count() or 1
+    memory = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 2**30
+    return max(1, min(cores, int(memory // memory_per_process)))
+
+def get_batch_size(n_texts: int, n_process: int) -> int:
+    """Give every process at least a few batches to work on, between 64 and
+    1000 comments each."""
+    return max(64, min(1000, n_texts // (n_process * 8) or 1))
+
+def load_lemmatizer() -> Language:
+    """Load pt_core_news_lg with only what the lemmas depend on enabled. The
+    lexical attributes used by <is_valid_token> come from the tokenizer and
+    the vocabulary, not from any pipeline component."""
+    nlp = spacy.load("pt_core_news_lg", 
+                     exclude=["tagger", "ner", "morphologizer"])     
+    nlp.select_pipes(disable=[pipe for pipe in nlp.pipe_names 
+                              if pipe not in LEMMA_PIPES])
+    return nlp
+
+def spacy_preprocessing(df: pd.DataFrame, 
+                        nlp: Language,
+                        n_process: int | None=None,
+                        batch_size: int | None=None) -> pd.DataFrame:
+    """Replace each comment by its valid lemmas.
+
+    The lemmas are collected in a preallocated array in the order nlp.pipe
+    returns them, which is the order of the comments, and assigned to the
+    comment column at once.
+    """
+    n_process = n_process or get_n_process()
+    batch_size = batch_size or get_batch_size(len(df), n_process)
+    lemmas = np.empty(len(df), dtype=object)
+
+    start = time.perf_counter()
+    docs = nlp.pipe(df["comment"], n_process=n_process, batch_size=batch_size)
+    for idx, doc in enumerate(tqdm(docs, total=len(df), 
+                                   desc="spacy_preprocessing")):
+        lemmas[idx] = " ".join([token.lemma_ for token in doc 
+                                if is_valid_token(token)])
+    elapsed = time.perf_counter() - start
+
+    print(f"Lemmatized [{len(df)}] comments in [{elapsed:.0f}s], " \
+          f"[{len(df) / max(elapsed, 1e-9):.0f}] comments/s with " \
+          f"n_process=[{n_process}] batch_size=[{batch_size}] " \
+          f"pipes={nlp.pipe_names}")
+
+    df["comment"] = lemmas
     return df
 
+def read_input_dataset() -> pd.DataFrame:
+    """Read the deduplicated comments if they were built from the current
+    data_filtered.parquet, see dataset.is_current, the filtered ones
+    otherwise."""
+    if is_current("data_deduplicated.pkl"):
+        return pd.read_pickle(f"{INSTAGRAM_DATA_DIR}/data_deduplicated.pkl")
+    if os.path.exists(f"{INSTAGRAM_DATA_DIR}/data_deduplicated.pkl"):
+        print("[data_deduplicated.pkl] is outdated, skipping it.")
+    return pd.read_parquet(f"{INSTAGRAM_DATA_DIR}/data_filtered.parquet")
+
 def main():
     """If <n_process> is activated, gpu must not be used in paralell as it'll
     lead to conflict"""
 
-    df = pd.read_pickle(f"{INSTAGRAM_DATA_DIR}/data_filtered.pkl")
+    df = read_input_dataset()
 
-    df['comment'] = df['comment'].apply(str.lower) 
-    df['comment'] = df['comment'].apply(remove_hashtag)
-    df['comment'] = df['comment'].apply(remove_mention)
-    df['comment'] = df['comment'].apply(remove_laughter)
+    df['comment'] = clean_texts(df['comment'], platform="instagram")
     normalized_words = get_normalized_words()
-    df.replace(normalized_words, regex=True, inplace=True)
+    df['comment'] = normalize_texts(df['comment'], normalized_words)
 
-    nlp = spacy.load("pt_core_news_lg", 
-                     exclude=["tagger", "ner", "morphologizer"])     
-    docs = nlp.pipe(df["comment"], n_process=6) 
-    df = spacy_preprocessing(df, docs)
+    nlp = load_lemmatizer()
+    df = spacy_preprocessing(df, nlp)
 
     normalized_words = get_normalized_words()
-    df['comment'] = df['comment'].replace(normalized_words, regex=True)
-    df['comment'] = df['comment'].apply(lambda x: re.sub(r'\s+', ' ', x).strip())
+    df['comment'] = tidy_texts(df['comment'], normalized_words)
     df['comment'] = df['comment'].replace('', np.nan)
     df.dropna(subset=['comment'], inplace=True)
+    if "multiplicity" in df.columns:
+        df["multiplicity"] = df.groupby("comment")["multiplicity"].transform("sum")
     df.drop_duplicates(subset="comment", keep="first", inplace=True)
-    df['comment'] = df['comment'].apply(str.lower)
     df["token_count"] = df["comment"].apply(lambda x: len(x.split()))
 
     df = pd.read_pickle(f"{INSTAGRAM_DATA_DIR}/data_preprocessed.pkl")
@@ -1,4 +1,5 @@
 import os
+import sys
 from typing import List, Tuple
 import pandas as pd
 from numpy import ndarray
@@ -7,6 +8,7 @@ from sentence_transformers import SentenceTransformer
 from umap import UMAP
 from hdbscan import HDBSCAN
 from bertopic import BERTopic
+from embedding import EMBEDDING_MODEL, encode, load_embedding_model
 
 INSTAGRAM_DIR = f"/home/{os.getlogin()}/Desktop/bachelor_thesis/instagram"
 
@@ -21,18 +23,17 @@ def get_umap(n_neighbors=20, n_components=5, min_dist=0.0, metric="cosine",
 def get_hdbscan(min_cluster_size=10) -> HDBSCAN:
     return HDBSCAN(min_cluster_size=min_cluster_size, prediction_data=True)
 
-def get_embedding_model(docs: List[str]) -> Tuple[SentenceTransformer, ndarray]:
-    embedding_model = SentenceTransformer(
-        model_name_or_path="paraphrase-multilingual-MiniLM-L12-v2", 
-        device="cuda")
+def get_embedding_model(docs: List[str], 
+                        backend: str="auto") -> Tuple[SentenceTransformer, ndarray]:
+    """backend: see embedding.EMBEDDING_BACKENDS, "auto" uses the GPU if there
+    is one and the int8 model on all cores otherwise"""
+    embedding_model = load_embedding_model(backend)
     
-    embeddings = embedding_model.encode(docs, 
-                                        show_progress_bar=True, 
-                                        batch_size=32)
+    embeddings = encode(embedding_model, docs, backend=backend)
     return embedding_model, embeddings
 
-def topic_modeling(docs: List[str]) -> BERTopic:
-    embedding_model, embeddings = get_embedding_model(docs)
+def topic_modeling(docs: List[str], backend: str="auto") -> BERTopic:
+    embedding_model, embeddings = get_embedding_model(docs, backend)
     umap_model, hdbscan_model = get_umap(), get_hdbscan()
     vectorizer_model = CountVectorizer(ngram_range=(1,1))
     top_n_words = 10
@@ -62,7 +63,7 @@ def save_topic_model(topic_model: BERTopic) -> None:
         save_path,
         serialization="safetensors",
         save_ctfidf=True,
-        save_embedding_model="sentence-transformers/all-MiniLM-L6-v2"
+        save_embedding_model=f"sentence-transformers/{EMBEDDING_MODEL}"
     )
 
 def get_topic_info(topic_model: BERTopic) -> None: 
@@ -90,7 +91,7 @@ def get_topics_over_time(topic_model: BERTopic,
     ).write_image(f"{INSTAGRAM_DIR}/result/topics_over_time.svg", 
                   engine="orca")
 
-def main():
+def main(backend: str="auto"):
     save_path = f"{INSTAGRAM_DIR}/result/"
     if not os.path.exists(save_path): 
         os.makedirs(save_path)
@@ -104,7 +105,7 @@ def main():
     docs = df["comment"].astype(str).tolist()
     timestamps = df["date"].astype(str).tolist()
 
-    topic_model = topic_modeling(docs)
+    topic_model = topic_modeling(docs, backend)
 
     save_topic_model(topic_model)
     get_topic_info(topic_model)
@@ -113,4 +114,7 @@ def main():
 
 if __name__ == "__main__":
     os.environ["TOKENIZERS_PARALLELISM"] = "false"
-    main()
\ No newline at end of file
+    # e.g. python process.py --backend=onnx
+    backends = [arg.split("=", 1)[1] for arg in sys.argv 
+                if arg.startswith("--backend=")]
+    main(backend=backends[-1] if backends else "auto")
\ No newline at end of file
@@ -0,0 +1,111 @@
+import gzip
+import json
+import time
+import random
+import threading
+import http.client
+from io import BytesIO
+from queue import Empty, LifoQueue
+from typing import Dict
+from urllib.error import HTTPError
+from urllib.parse import urlencode, urlsplit
+
+API_URL = "https://www.googleapis.com/youtube/v3"
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+class YouTubeClient:
+    """Keep-alive HTTP client for the YouTube Data API v3.
+
+    Open connections are put back into a pool after each response and reused
+    by the next request, from whichever thread. Responses are requested
+    gzipped; Google only compresses when the user agent contains "gzip" too.
+    429 and 5xx answers as well as dropped connections are retried with
+    exponential backoff and full jitter. Other error codes are raised as
+    HTTPError, like urlopen does.
+    """
+
+    def __init__(self,
+                 base_url: str=API_URL,
+                 max_retries: int=5,
+                 backoff: float=1.0,
+                 timeout: float=60):
+        url = urlsplit(base_url)
+        self.scheme = url.scheme
+        self.host = url.netloc
+        self.path = url.path.rstrip("/")
+        self.base_url = base_url
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.connections = LifoQueue()
+
+    def get_connection(self) -> http.client.HTTPConnection:
+        try:
+            return self.connections.get_nowait()
+        except Empty:
+            if self.scheme == "https":
+                return http.client.HTTPSConnection(self.host,
+                                                   timeout=self.timeout)
+            return http.client.HTTPConnection(self.host, timeout=self.timeout)
+
+    def sleep_before_retry(self, attempt: int) -> None:
+        time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+
+    def get(self, resource: str, params: Dict) -> Dict:
+        path = f"{self.path}/{resource}?{urlencode(params)}"
+        headers = {
+            "Accept-Encoding": "gzip",
+            "User-Agent": "bachelor_thesis (gzip)",
+        }
+
+        for attempt in range(self.max_retries + 1):
+            connection = self.get_connection()
+            try:
+                connection.request("GET", path, headers=headers)
+                response = connection.getresponse()
+                body = response.read()
+            except (http.client.HTTPException, ConnectionError, TimeoutError):
+                connection.close()
+                if attempt == self.max_retries:
+                    raise
+                self.sleep_before_retry(attempt)
+                continue
+
+            if response.will_close:
+                connection.close()
+            else:
+                self.connections.put(connection)
+
+            if response.getheader("Content-Encoding") == "gzip":
+                body = gzip.decompress(body)
+
+            if response.status in RETRY_STATUS and attempt < self.max_retries:
+                self.sleep_before_retry(attempt)
+                continue
+            if response.status >= 400:
+                raise HTTPError(f"{self.base_url}/{resource}", response.status,
+                                response.reason, response.headers,
+                                BytesIO(body))
+            return json.loads(body)
+
+_clients = dict()
+_clients_lock = threading.Lock()
+
+def get_client(api_key: str, base_url: str=API_URL) -> YouTubeClient:
+    """Return the client shared by every request made with <api_key>."""
+    with _clients_lock:
+        if (api_key, base_url) not in _clients:
+            _clients[(api_key, base_url)] = YouTubeClient(base_url)
+        return _clients[(api_key, base_url)]
+
+def fetch_json(resource: str, params: Dict, base_url: str=API_URL) -> Dict:
+    """Request a resource of the YouTube Data API v3 and return its JSON body.
+
+    The discovery client isn't thread safe, so the requests go through the
+    <YouTubeClient> of the api key in <params> instead. <base_url> can point
+    to a local server, e.g. the one in tests/fake_api.py.
+
+    :resource: e.g. "commentThreads", "comments" or "videos"
+    :params: query parameters, including the api key
+    """
+    return get_client(params["key"], base_url).get(resource, params)
@@ -0,0 +1,111 @@
+import os
+import json
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List
+from zoneinfo import ZoneInfo
+
+YOUTUBE_DATA_DIR = f"/home/{os.getlogin()}/Desktop/bachelor_thesis/youtube/data"
+
+# every project gets 10.000 units per day, reset at midnight Pacific Time
+DAILY_QUOTA = 10000
+QUOTA_TIMEZONE = ZoneInfo("America/Los_Angeles")
+
+# https://developers.google.com/youtube/v3/determine_quota_cost
+QUOTA_COST = {
+    "commentThreads": 1,
+    "comments": 1,
+    "videos": 1,
+    "playlistItems": 1,
+}
+
+class QuotaExceeded(Exception):
+    """Raised when a key can't pay for another request today."""
+
+class ApiKeyPool:
+    """Keep track of the quota units every api key spent today.
+
+    Each request is charged before it is sent, so a key is retired once it
+    would go over <daily_quota> minus <reserve> instead of when the API starts
+    answering 403. The <reserve> covers requests the estimate doesn't know
+    about, e.g. made by other scripts with the same key. The counters start
+    from zero again on the next Pacific Time day and are kept in <usage_file>
+    so restarting the extractor doesn't forget what was spent.
+    """
+
+    def __init__(self,
+                 api_keys: List[str],
+                 daily_quota: int=DAILY_QUOTA,
+                 reserve: int=100,
+                 usage_file: str=f"{YOUTUBE_DATA_DIR}/youtube_api_quota.json"):
+        self.api_keys = list(dict.fromkeys(api_keys))
+        self.daily_quota = daily_quota
+        self.reserve = reserve
+        self.usage_file = usage_file
+        self.lock = threading.Lock()
+        self.day = self.get_day()
+        self.usage = {api_key: 0 for api_key in self.api_keys}
+
+        if os.path.exists(usage_file):
+            with open(usage_file, "r") as file:
+                saved = json.load(file)
+            if saved.get("day") == self.day:
+                for api_key, units in saved.get("usage", {}).items():
+                    if api_key in self.usage:
+                        self.usage[api_key] = units
+
+    @staticmethod
+    def get_day() -> str:
+        return datetime.now(QUOTA_TIMEZONE).date().isoformat()
+
+    @staticmethod
+    def get_seconds_until_reset() -> float:
+        now = datetime.now(QUOTA_TIMEZONE)
+        midnight = (now + timedelta(days=1)).replace(hour=0, minute=0,
+                                                     second=0, microsecond=0)
+        return (midnight - now).total_seconds()
+
+    def reset_if_new_day(self) -> None:
+        """Set all counters back to zero once the quota day changed. Must be
+        called while holding <self.lock>."""
+        day = self.get_day()
+        if day != self.day:
+            self.day = day
+            self.usage = {api_key: 0 for api_key in self.api_keys}
+
+    def spend(self, api_key: str, resource: str) -> None:
+        """Charge the cost of one request on <resource> to <api_key>."""
+        cost = QUOTA_COST.get(resource, 1)
+        with self.lock:
+            self.reset_if_new_day()
+            if self.usage[api_key] + cost > self.daily_quota - self.reserve:
+                raise QuotaExceeded(f"api key [{api_key[:8]}...] spent " \
+                                    f"[{self.usage[api_key]}] units today.")
+            self.usage[api_key] += cost
+
+    def retire(self, api_key: str) -> None:
+        """Mark a key as exhausted for the rest of the day, e.g. after a 403."""
+        with self.lock:
+            self.reset_if_new_day()
+            self.usage[api_key] = self.daily_quota
+
+    def is_live(self, api_key: str) -> bool:
+        with self.lock:
+            self.reset_if_new_day()
+            return self.usage[api_key] < self.daily_quota - self.reserve
+
+    def get_live_keys(self) -> List[str]:
+        return [api_key for api_key in self.api_keys if self.is_live(api_key)]
+
+    def get_usage(self) -> Dict[str, int]:
+        with self.lock:
+            self.reset_if_new_day()
+            return dict(self.usage)
+
+    def save(self) -> None:
+        with self.lock:
+            self.reset_if_new_day()
+            data = {"day": self.day, "usage": self.usage}
+            with open(f"{self.usage_file}.tmp", "w") as file:
+                json.dump(data, file, indent=4)
+            os.replace(f"{self.usage_file}.tmp", self.usage_file)
@@ -0,0 +1,22 @@
+from umap import UMAP
+from hdbscan import HDBSCAN
+
+# kept apart from process.py, so that the sweep workers get UMAP and HDBSCAN
+# without importing BERTopic and torch
+
+UMAP_NEIGHBORS = 5
+
+def get_umap(n_neighbors=UMAP_NEIGHBORS, n_components=5, min_dist=0.0, 
+             metric="cosine", random_state=42, 
+             precomputed_knn=(None, None, None)) -> UMAP:
+    return UMAP(n_neighbors=n_neighbors,
+                n_components=n_components,
+                min_dist=min_dist,
+                metric=metric,
+                random_state=random_state,
+                precomputed_knn=precomputed_knn)
+
+def get_hdbscan(min_cluster_size=10, min_samples=None) -> HDBSCAN:
+    return HDBSCAN(min_cluster_size=min_cluster_size, 
+                   min_samples=min_samples,
+                   prediction_data=True)
@@ -0,0 +1,241 @@
+import os
+import json
+import uuid
+import shutil
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Tuple
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+YOUTUBE_DATA_DIR = f"/home/{os.getlogin()}/Desktop/bachelor_thesis/youtube/data"
+
+# the stages hand over parquet datasets in hive layout, i.e.
+# <name>/channel=<channel>/year=<year>/<part>.parquet
+PARTITIONING = ds.partitioning(
+    pa.schema([("channel", pa.string()), ("year", pa.string())]),
+    flavor="hive"
+)
+PARTITION_COLS = PARTITIONING.schema.names
+
+# the preprocessed comments are stored once, the token thresholds the analysis
+# compares are views over the column [token_count], see <read_preprocessed>
+PREPROCESSED_DATASET = "data_preprocessed"
+TOKEN_THRESHOLDS = [100, 75, 50, 25, 10, 1]
+# small enough that a partition has several row groups to skip, the default
+# of about 1M rows puts most partitions in a single one
+PREPROCESSED_ROW_GROUP_SIZE = 20000
+# written into every dataset, the leading underscore keeps pyarrow from
+# reading it as data
+DATASET_INFO = "_dataset.json"
+# the years the analysis covers, the daily updates of online.py add later ones
+YEARS = ["2020", "2021", "2022"]
+# when a comment entered data_filtered, carried through every later stage so
+# that an update can tell its rows apart from the ones already processed
+INGESTED_COLUMN = "ingested_at"
+
+def get_dataset_path(name: str) -> str:
+    return f"{YOUTUBE_DATA_DIR}/{name}"
+
+def dataset_exists(name: str) -> bool:
+    return os.path.isdir(get_dataset_path(name))
+
+def delete_dataset(name: str) -> None:
+    if dataset_exists(name):
+        shutil.rmtree(get_dataset_path(name))
+
+def replace_dataset(name: str, new_name: str) -> None:
+    """Swap the complete dataset <new_name> in as <name>, e.g. one written
+    batch by batch, so that a crash never leaves half of it as <name>."""
+    delete_dataset(name)
+    os.rename(get_dataset_path(new_name), get_dataset_path(name))
+
+def get_ingestion_time() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S")
+
+def get_dataset_info(name: str) -> Dict | None:
+    """Return the version of a dataset and the version of the dataset it was
+    built from, None for datasets written before this was recorded."""
+    info_path = f"{get_dataset_path(name)}/{DATASET_INFO}"
+    if not os.path.exists(info_path):
+        return None
+    with open(info_path, "r") as file:
+        return json.load(file)
+
+def is_current(name: str) -> bool:
+    """Whether a dataset exists and was built from the version of its source
+    that exists now, and that source the same way, e.g. data_deduplicated
+    is outdated as soon as data_filtered is written again."""
+    info = get_dataset_info(name) if dataset_exists(name) else None
+    if info is None:
+        return False
+    if info["source"] is None:
+        return True
+    source_info = get_dataset_info(info["source"]) \
+                  if dataset_exists(info["source"]) else None
+    return source_info is not None \
+           and source_info["version"] == info["source_version"] \
+           and is_current(info["source"])
+
+def get_dataset_columns(name: str) -> List[str]:
+    """Return the column names of a dataset without reading any rows."""
+    return ds.dataset(get_dataset_path(name), format="parquet",
+                      partitioning=PARTITIONING).schema.names
+
+def write_dataset(df: pd.DataFrame, 
+                  name: str, 
+                  append: bool=False,
+                  source: str | None=None,
+                  row_group_size: int | None=None,
+                  keep_source: bool=False) -> None:
+    """Save a DataFrame with the columns [channel, date] as a parquet dataset
+    partitioned by channel and year.
+
+    Without <append> the dataset is written next to the old one first and
+    only swapped in when complete, so a crash never leaves half a dataset.
+    It is recorded together with the current version of the dataset
+    <source> it was built from, see <is_current>. With <append> the rows are
+    added as new files to the existing dataset, and if built from the newest
+    rows of <source> that version of it is recorded. Either way the dataset
+    gets a new version, which outdates everything built from the old one,
+    even if <df> is empty. With <keep_source>, for stages that only add
+    columns, the source and source version of the existing dataset are kept
+    as they are, also none if it has none, so an outdated dataset stays
+    outdated.
+
+    With <row_group_size> the files keep the row order of <df> and are split
+    into row groups of at most that many rows, so that filters on a column
+    <df> is sorted by skip most of them.
+    """
+    path = get_dataset_path(name)
+    write_path = path if append else f"{path}.tmp"
+    if not append and os.path.exists(write_path):
+        shutil.rmtree(write_path)
+
+    info = get_dataset_info(name) if dataset_exists(name) else None
+    if keep_source:
+        if info is not None:
+            info = {"source": info["source"],
+                    "source_version": info["source_version"]}
+    elif not append or info is None or source is not None:
+        source_info = get_dataset_info(source) if source else None
+        info = {"source": source,
+                "source_version": source_info and source_info["version"]}
+    os.makedirs(write_path, exist_ok=True)
+    if info is not None:
+        with open(f"{write_path}/{DATASET_INFO}", "w") as file:
+            json.dump({**info, "version": uuid.uuid4().hex}, file, indent=4)
+
+    if len(df):
+        df = df.assign(year=df["date"].astype(str).str[:4])
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        pq.write_to_dataset(table,
+                            root_path=write_path,
+                            partitioning=PARTITIONING,
+                            basename_template=f"{uuid.uuid4().hex}-{{i}}.parquet",
+                            existing_data_behavior="overwrite_or_ignore",
+                            **({"row_group_size": row_group_size,
+                                "preserve_order": True} if row_group_size else {}))
+
+    if not append:
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.rename(write_path, path)
+
+def write_preprocessed(df: pd.DataFrame,
+                       source: str | None=None,
+                       append: bool=False) -> None:
+    """Save the preprocessed comments, longest first in row groups of
+    PREPROCESSED_ROW_GROUP_SIZE, so that within every partition the row
+    groups of a token threshold view are contiguous and the others are
+    skipped by their [token_count] statistics. Without <source>, for the
+    stages that only add columns, the dataset stays built from the same
+    version of its source, see write_dataset(keep_source=True). With
+    <append> the rows of an update are added as files of their own, sorted
+    the same way."""
+    df = df.sort_values("token_count", ascending=False, kind="stable")
+    write_dataset(df, PREPROCESSED_DATASET, append=append, source=source,
+                  row_group_size=PREPROCESSED_ROW_GROUP_SIZE,
+                  keep_source=source is None)
+
+def open_dataset(name: str,
+                 columns: List[str] | None=None) -> Tuple[ds.Dataset, List[str]]:
+    """The dataset <name> and the columns to read from it, all but the year
+    column if None. The year column only exists to partition the files."""
+    dataset = ds.dataset(get_dataset_path(name), format="parquet",
+                         partitioning=PARTITIONING)
+    if columns is None:
+        columns = [column for column in dataset.schema.names
+                   if column != "year"]
+    return dataset, columns
+
+def read_dataset(name: str,
+                 columns: List[str] | None=None,
+                 filters: List[Tuple] | None=None) -> pd.DataFrame:
+    """Load a dataset, reading only the given columns and only the rows that
+    pass <filters>, e.g. [("lang", "==", "pt")]. Filters on channel or year
+    skip whole directories, others skip row groups by their statistics.
+
+    The year column only exists to partition the files, it's left out unless
+    it is asked for.
+    """
+    dataset, columns = open_dataset(name, columns)
+    table = dataset.to_table(
+        columns=columns,
+        filter=pq.filters_to_expression(filters) if filters else None
+    )
+    return table.to_pandas()
+
+def iter_dataset(name: str,
+                 columns: List[str] | None=None,
+                 filters: List[Tuple] | None=None,
+                 batch_size: int=100000) -> Iterator[pd.DataFrame]:
+    """Like <read_dataset>, but in DataFrames of about <batch_size> rows, so
+    that only one of them is in memory at a time."""
+    dataset, columns = open_dataset(name, columns)
+    batches = list()
+    n_rows = 0
+    for batch in dataset.to_batches(
+        columns=columns,
+        filter=pq.filters_to_expression(filters) if filters else None,
+        batch_size=batch_size
+    ):
+        batches.append(batch)
+        n_rows += batch.num_rows
+        if n_rows >= batch_size:
+            yield pa.Table.from_batches(batches).to_pandas()
+            batches, n_rows = list(), 0
+    if n_rows:
+        yield pa.Table.from_batches(batches).to_pandas()
+
+def get_preprocessed_filters(min_tokens: int,
+                             filters: List[Tuple] | None,
+                             years: List[str] | None) -> List[Tuple]:
+    filters = [("token_count", ">=", min_tokens)] + (filters or [])
+    if years is not None:
+        filters.append(("year", "in", years))
+    return filters
+
+def read_preprocessed(min_tokens: int=1,
+                      columns: List[str] | None=None,
+                      filters: List[Tuple] | None=None,
+                      years: List[str] | None=YEARS) -> pd.DataFrame:
+    """Load the preprocessed comments with at least <min_tokens> tokens from
+    <years>, all years if None. The threshold is pushed down into the read
+    like any other filter, the files are sorted by token count in row groups
+    of PREPROCESSED_ROW_GROUP_SIZE so that most of them are skipped whole."""
+    return read_dataset(PREPROCESSED_DATASET,
+                        columns=columns,
+                        filters=get_preprocessed_filters(min_tokens, filters, years))
+
+def iter_preprocessed(min_tokens: int=1,
+                      columns: List[str] | None=None,
+                      filters: List[Tuple] | None=None,
+                      years: List[str] | None=YEARS,
+                      batch_size: int=100000) -> Iterator[pd.DataFrame]:
+    """Like <read_preprocessed>, in DataFrames of about <batch_size> rows."""
+    return iter_dataset(PREPROCESSED_DATASET,
+                        columns=columns,
+                        filters=get_preprocessed_filters(min_tokens, filters, years),
+                        batch_size=batch_size)
@@ -0,0 +1,107 @@
+import hashlib
+import zlib
+from collections import defaultdict
+from typing import List
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+from dataset import read_dataset, write_dataset
+
+# MinHash/LSH settings: 64 permutations in 8 bands of 8 rows make pairs with a
+# Jaccard similarity around 0.77 likely to share a bucket, candidates are then
+# kept only if their estimated similarity reaches NEAR_DUPLICATE_THRESHOLD
+NUM_PERM = 64
+BANDS = 8
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 5
+NEAR_DUPLICATE_THRESHOLD = 0.8
+# shorter comments are only deduplicated exactly, a few characters change the
+# meaning of "vacina sim" and "vacina não"
+MIN_NEAR_DUPLICATE_LENGTH = 30
+
+PRIME = (1 << 31) - 1
+_generator = np.random.default_rng(42)
+PERM_A = _generator.integers(1, PRIME, size=NUM_PERM, dtype=np.uint64)
+PERM_B = _generator.integers(0, PRIME, size=NUM_PERM, dtype=np.uint64)
+
+def normalize(text: str) -> str:
+    return " ".join(text.lower().split())
+
+def get_content_hash(text: str) -> str:
+    return hashlib.blake2b(normalize(text).encode("utf-8"),
+                           digest_size=16).hexdigest()
+
+def get_minhash(text: str) -> np.ndarray:
+    """Return the MinHash signature of the character shingles of a text."""
+    text = normalize(text)
+    shingles = {text[i:i + SHINGLE_SIZE]
+                for i in range(max(1, len(text) - SHINGLE_SIZE + 1))}
+    hashes = np.fromiter((zlib.crc32(shingle.encode("utf-8")) % PRIME
+                          for shingle in shingles),
+                         dtype=np.uint64, count=len(shingles))
+    return ((np.outer(PERM_A, hashes) + PERM_B[:, None]) % PRIME).min(axis=1)
+
+def get_near_duplicate_parents(texts: List[str]) -> np.ndarray:
+    """Map every text to the index of the first text it is a near-duplicate
+    of, or to itself.
+
+    Each text is looked up in the LSH buckets of the texts seen before it and
+    only registered in the buckets if no similar enough text was found, so
+    the buckets only ever hold originals.
+    """
+    parents = np.arange(len(texts))
+    buckets = [defaultdict(list) for _ in range(BANDS)]
+    signatures = dict()
+
+    for idx, text in enumerate(tqdm(texts, desc="get_near_duplicate_parents")):
+        if len(text) < MIN_NEAR_DUPLICATE_LENGTH:
+            continue
+
+        signature = get_minhash(text)
+        band_keys = [signature[band * ROWS:(band + 1) * ROWS].tobytes()
+                     for band in range(BANDS)]
+
+        candidates = {candidate for band, key in enumerate(band_keys)
+                      for candidate in buckets[band].get(key, ())}
+        for candidate in sorted(candidates):
+            similarity = np.mean(signatures[candidate] == signature)
+            if similarity >= NEAR_DUPLICATE_THRESHOLD:
+                parents[idx] = candidate
+                break
+        else:
+            signatures[idx] = signature
+            for band, key in enumerate(band_keys):
+                buckets[band][key].append(idx)
+
+    return parents
+
+def deduplicate(df: pd.DataFrame) -> pd.DataFrame:
+    """Keep the first occurrence of every comment and count its copies in the
+    column [multiplicity]. Comments are exact duplicates if they are equal up
+    to case and whitespace, near-duplicates if their estimated Jaccard
+    similarity reaches NEAR_DUPLICATE_THRESHOLD."""
+    df = df.reset_index(drop=True)
+    if "multiplicity" not in df.columns:
+        df["multiplicity"] = 1
+
+    content_hash = df["comment"].map(get_content_hash)
+    df["multiplicity"] = df.groupby(content_hash)["multiplicity"].transform("sum")
+    df = df[~content_hash.duplicated()].reset_index(drop=True)
+    exact_count = len(df)
+
+    parents = get_near_duplicate_parents(df["comment"].tolist())
+    df["multiplicity"] = df.groupby(parents)["multiplicity"].transform("sum")
+    df = df[parents == np.arange(len(df))].reset_index(drop=True)
+
+    print(f"Kept [{len(df)}] comments, [{exact_count - len(df)}] " \
+          f"near-duplicates removed.")
+    return df
+
+def main():
+    df = read_dataset("data_filtered")
+    print(f"Deduplicating [{len(df)}] comments...")
+    df = deduplicate(df)
+    write_dataset(df, "data_deduplicated", source="data_filtered")
+
+if __name__ == "__main__":
+    main()
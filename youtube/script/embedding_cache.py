@@ -0,0 +1,96 @@
+import os
+import uuid
+import hashlib
+from typing import Callable, Dict, List, Tuple
+import numpy as np
+
+YOUTUBE_DATA_DIR = f"/home/{os.getlogin()}/Desktop/bachelor_thesis/youtube/data"
+EMBEDDING_CACHE_DIR = f"{YOUTUBE_DATA_DIR}/embedding_cache"
+KEYS_SUFFIX = ".keys.npy"
+
+def get_text_hash(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+def save_array(path: str, array: np.ndarray) -> None:
+    """Write next to <path> first, so that a crash never leaves half a file."""
+    with open(f"{path}.tmp", "wb") as file:
+        np.save(file, array)
+    os.replace(f"{path}.tmp", path)
+
+class EmbeddingCache:
+    """Embeddings of one model on disk, addressed by the hash of the text they
+    encode, so the same comment is encoded once for every token threshold and
+    every run.
+
+    Every call that encodes new texts adds a chunk of two files,
+    <chunk>.npy with the embeddings and <chunk>.keys.npy with their text
+    hashes. The keys are written last and mark the chunk as complete. The
+    embeddings are opened memory-mapped, only the rows looked up are read.
+    """
+    def __init__(self,
+                 model_name: str,
+                 cache_dir: str=EMBEDDING_CACHE_DIR,
+                 dtype: np.dtype=np.float16):
+        self.path = f"{cache_dir}/{model_name.replace('/', '__')}"
+        self.dtype = np.dtype(dtype)
+        self.chunks: List[np.ndarray] = list()
+        # text hash => (chunk, row)
+        self.index: Dict[str, Tuple[int, int]] = dict()
+
+        os.makedirs(self.path, exist_ok=True)
+        for filename in sorted(os.listdir(self.path)):
+            if filename.endswith(KEYS_SUFFIX):
+                self.load_chunk(filename[:-len(KEYS_SUFFIX)])
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, text: str) -> bool:
+        return get_text_hash(text) in self.index
+
+    def load_chunk(self, chunk_id: str) -> None:
+        chunk = len(self.chunks)
+        self.chunks.append(np.load(f"{self.path}/{chunk_id}.npy", mmap_mode="r"))
+        keys = np.load(f"{self.path}/{chunk_id}{KEYS_SUFFIX}")
+        for row, text_hash in enumerate(keys.tolist()):
+            self.index.setdefault(text_hash, (chunk, row))
+
+    def add(self, text_hashes: List[str], embeddings: np.ndarray) -> None:
+        chunk_id = uuid.uuid4().hex
+        save_array(f"{self.path}/{chunk_id}.npy", embeddings.astype(self.dtype))
+        save_array(f"{self.path}/{chunk_id}{KEYS_SUFFIX}",
+                   np.array(text_hashes, dtype="U32"))
+        self.load_chunk(chunk_id)
+
+    def get_embeddings(self,
+                       texts: List[str],
+                       encode: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """Return the float32 embeddings of <texts> in their order. Texts not
+        in the cache yet are encoded with <encode>, each distinct one once,
+        and added to it. No texts give a (0, dim) array, like encode does."""
+        text_hashes = [get_text_hash(text) for text in texts]
+        missing = dict()
+        cached = 0
+        for text_hash, text in zip(text_hashes, texts):
+            if text_hash in self.index:
+                cached += 1
+            else:
+                missing.setdefault(text_hash, text)
+
+        print(f"Embeddings: [{cached}] of [{len(texts)}] texts cached, " \
+              f"encoding [{len(missing)}] distinct texts...")
+        if missing:
+            self.add(list(missing), np.asarray(encode(list(missing.values()))))
+
+        if not texts:
+            if not self.chunks:
+                return np.asarray(encode([]), dtype=np.float32)
+            return np.empty((0, self.chunks[0].shape[1]), dtype=np.float32)
+
+        locations = np.array([self.index[text_hash] for text_hash in text_hashes])
+        embeddings = np.empty((len(texts), self.chunks[0].shape[1]),
+                              dtype=np.float32)
+        for chunk in np.unique(locations[:, 0]):
+            positions = np.flatnonzero(locations[:, 0] == chunk)
+            embeddings[positions] = self.chunks[chunk][locations[positions, 1]]
+        return embeddings
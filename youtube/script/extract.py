@@ -2,37 +2,96 @@ import os
 import re
 import sys
 import json
+import time
+import threading
+from queue import Empty, Queue
 from typing import Dict, List
 from tqdm import tqdm
 from dotenv import load_dotenv, find_dotenv
-from urllib.request import urlopen
+from concurrent.futures import ThreadPoolExecutor
 from urllib.error import HTTPError
-from googleapiclient.discovery import build
+from api import API_URL, fetch_json
+from api_key_pool import ApiKeyPool, QuotaExceeded
+from storage import get_latest_comment_dates, save_video
 _ = load_dotenv(find_dotenv())
 
 YOUTUBE_DATA_DIR = f"/home/{os.getlogin()}/Desktop/bachelor_thesis/youtube/data"
 
+# partial responses, only the fields that are stored are downloaded
+VIDEO_FIELDS = "items(snippet(publishedAt,title,channelTitle))"
+THREAD_FIELDS = "nextPageToken,items(id,snippet(totalReplyCount," \
+                "topLevelComment(id,snippet(textDisplay,publishedAt)))," \
+                "replies(comments(id,snippet(textDisplay,publishedAt))))"
+REPLY_FIELDS = "nextPageToken,items(id,snippet(textDisplay,publishedAt))"
+
+CHECKPOINT_DIR = f"{YOUTUBE_DATA_DIR}/checkpoint"
+
+# 403 reasons that mean the key is spent, any other 403, e.g. commentsDisabled
+# or forbidden, is a problem of the video
+# https://developers.google.com/youtube/v3/docs/errors
+QUOTA_REASONS = {"quotaExceeded", "dailyLimitExceeded"}
+
+# the extraction workers share youtube_video.txt
+_video_file_lock = threading.Lock()
+
 def get_youtube_comments(video_url: str,
                          api_key: str,
-                         max_number_of_comments: int=50000) -> Dict[str, str]:
+                         max_number_of_comments: int=50000,
+                         max_workers: int=8,
+                         inline_replies: bool=True,
+                         key_pool: ApiKeyPool | None=None,
+                         newer_than: str | None=None,
+                         base_url: str=API_URL) -> Dict[str, str]:
     
     """Return a dict with the information of the given video
 
+    The next page of comment threads is requested as soon as the current one
+    arrives, so it downloads while the replies of the current page are fetched
+    concurrently. At most <max_workers> requests are in flight at once.
+
+    Every finished page is appended to a checkpoint of the video together
+    with the token of the next page. If the video was interrupted before, e.g.
+    because the key ran out of quota, it resumes from that token instead of
+    the first page.
+
+    With <newer_than> the threads are requested newest first and paging stops
+    at the first thread that isn't newer, which makes refreshing a stored
+    video cost a few pages. New replies to older threads aren't picked up.
+
+    With <inline_replies> the threads are requested together with their
+    replies. The API embeds only the first few replies of a thread, so the
+    comments endpoint is called just for threads where fewer replies came
+    back than <totalReplyCount>.
+
     :video_url: YouTube video URL
     :api_key: YouTube API v3 key
     :number_comments: upper boundary of how many comments to retrieve
-    :return: a dict with all comments, where each comment is a separate string
+    :max_workers: maximum number of concurrent requests
+    :inline_replies: request the replies part of the comment threads
+    :key_pool: charges every request to <api_key>, 403 is returned once the
+               key would go over its daily quota
+    :newer_than: publishedAt of the newest comment already stored, only
+                 comment threads started after it are retrieved
+    :base_url: YouTube API v3 URL, can point to a local fake server
+    :return: a dict with all comments, where each comment is a separate
+             string, 403 if the key is out of quota, None if the comments of
+             the video can't be read, e.g. they are disabled or it is private
     """
 
     video_id = get_video_id_from_video_url(video_url)
 
-    youtube = build('youtube', 'v3', developerKey=api_key)
-    url = 'https://www.googleapis.com/youtube/v3/commentThreads?key=' \
-            + api_key + '&textFormat=plainText&part=snippet&videoId=' \
-            + video_id + '&maxResults=100'
-    raw_url = url
-    last_nextPageToken = '-'
-    comment_id = 0
+    thread_params = {
+        'key': api_key,
+        'textFormat': 'plainText',
+        'part': 'snippet,replies' if inline_replies else 'snippet',
+        'videoId': video_id,
+        'maxResults': 100,
+        'fields': THREAD_FIELDS,
+    }
+    if newer_than:
+        thread_params['order'] = 'time'
+    comment_count = 0
+    checkpoint = load_checkpoint(video_id)
 
     video_info = {
         'video_url': video_url,
@@ -43,100 +102,266 @@ def get_youtube_comments(video_url: str,
         'video_comment': [],
     }
 
-    while comment_id < max_number_of_comments:
-        try:
-            response = urlopen(url)
-            json_data = json.loads(response.read())
-
-            if not video_info['video_published_at']:
-                video_request = youtube.videos().list(
-                    part="snippet",
-                    id=video_id
+    if checkpoint:
+        video_info['video_comment'] = checkpoint['comments']
+        comment_count = sum(1 + len(comment['comment_reply']) 
+                         for comment in checkpoint['comments'])
+        if checkpoint['page_token']:
+            thread_params['pageToken'] = checkpoint['page_token']
+        print(f"Resuming from checkpoint with [{comment_count}] comments.")
+
+    pool = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        video_future = pool.submit(fetch_resource, 'videos',
+                                   {'key': api_key, 'part': 'snippet', 
+                                    'id': video_id, 'fields': VIDEO_FIELDS},
+                                   key_pool, base_url)
+        page_future = None
+        if not checkpoint or checkpoint['page_token']:
+            page_future = pool.submit(fetch_resource, 'commentThreads', 
+                                      thread_params, key_pool, base_url)
+
+        for item in video_future.result()['items']:
+            # video_info["video_channel_id"] = item['snippet']['channelId']
+            video_info["video_published_at"] = item['snippet']['publishedAt']
+            video_info["video_title"] = item['snippet']['title']
+            video_info["video_channel_title"] = item['snippet']['channelTitle']
+
+        while page_future and comment_count < max_number_of_comments:
+            json_data = page_future.result()
+
+            # keep only threads newer than what's stored, they come newest first
+            if newer_than:
+                items = [item for item in json_data['items']
+                         if item['snippet']['topLevelComment']['snippet']
+                                ['publishedAt'] > newer_than]
+                if len(items) < len(json_data['items']):
+                    json_data = {**json_data, 'items': items}
+                    json_data.pop('nextPageToken', None)
+
+            # prefetch the next page while the replies of this one download
+            next_page_token = json_data.get('nextPageToken')
+            page_future = None
+            if next_page_token:
+                page_future = pool.submit(
+                    fetch_resource, 'commentThreads',
+                    {**thread_params, 'pageToken': next_page_token},
+                    key_pool, base_url
                 )
-                video_response = video_request.execute()
-
-                for item in video_response['items']:
 
-                    video_published_at = item['snippet']['publishedAt']
-                    video_title = item['snippet']['title']
-                    # video_channel_id = item['snippet']['channelId']
-                    # video_description = item['snippet']['description']
-                    video_channel_title = item['snippet']['channelTitle']
-
-                # video_info["video_channel_id"] = video_channel_id
-                video_info["video_published_at"] = video_published_at
-                video_info["video_title"] = video_title
-                video_info["video_channel_title"] = video_channel_title
+            # threads whose replies didn't all come embedded in the page
+            reply_futures = {
+                item['id']: pool.submit(get_youtube_replies, item['id'], 
+                                        api_key, key_pool, base_url)
+                for item in json_data['items']
+                if item['snippet']['totalReplyCount'] > 
+                   len(item.get('replies', {}).get('comments', []))
+            }
 
+            page_comments = list()
             for item in tqdm(json_data['items']):
                 # comment_video_id = item['snippet']['videoId']
                 comment_text_display = item['snippet']['topLevelComment'] \
                                            ['snippet']['textDisplay']
                 comment_text_display = re.sub('[\s]+', ' ', comment_text_display)
                 comment_published_at = item['snippet']['topLevelComment']['snippet']['publishedAt']
-                comment_reply_count = item['snippet']['totalReplyCount']
 
                 comment_info = {
                     # 'comment_video_id': comment_video_id,
+                    'comment_id': item['id'],
                     'comment_text_display': comment_text_display,
                     'comment_published_at': comment_published_at,
                     # 'comment_reply_count': comment_reply_count,
                     'comment_reply':  []
                 }
 
-                if comment_reply_count > 0:
-                    parent_id = item['id']
-
-                    request_replies = youtube.comments().list(
-                        part='snippet',
-                        parentId=parent_id,
-                        maxResults=100
-                    )
-                    response_replies = request_replies.execute()
-
-                    for reply in response_replies['items']:
-                        reply_text_display = reply['snippet']['textDisplay']
-                        reply_published_at = reply['snippet']['publishedAt']
-                        reply_info = {
-                            'reply_published_at': reply_published_at,
-                            'reply_text_display': reply_text_display,
-                        }
-                        comment_info['comment_reply'].append(reply_info)
-                        comment_id += 1
-
-                video_info['video_comment'].append(comment_info)
+                if item['id'] in reply_futures:
+                    comment_info['comment_reply'] = reply_futures[item['id']].result()
+                elif 'replies' in item:
+                    comment_info['comment_reply'] = [
+                        get_reply_info(reply) 
+                        for reply in item['replies']['comments']
+                    ]
+                comment_count += len(comment_info['comment_reply'])
+
+                page_comments.append(comment_info)
                 
-                if comment_id > 50 and comment_id % 500 == 0:
-                    print(comment_id)
-                comment_id += 1
-
-            if 'nextPageToken' in json_data:
-                nextPageToken = json_data['nextPageToken']
-                url = raw_url + '&pageToken='+nextPageToken
-
-            if nextPageToken == last_nextPageToken:
-                print(f"Successfully retrieved [{comment_id}] comments.")
-                print("Can't go to the next page. Ending...")
-                break
-
-            last_nextPageToken = nextPageToken
-
-        except HTTPError as e:
-            if e.code == 403:
-                print("HTTP ERROR 403 => the API reached the \
-                      maximum allowed requests.")
-                return 403
-
-        except Exception as e:
-            print("Something went wrong:", e)
-            print(f"Successfully retrieved [{comment_id}] comments.")
-            break
+                if comment_count > 50 and comment_count % 500 == 0:
+                    print(comment_count)
+                comment_count += 1
+
+            video_info['video_comment'].extend(page_comments)
+            save_checkpoint(video_id, next_page_token, page_comments)
+
+        print(f"Successfully retrieved [{comment_count}] comments.")
+
+    except QuotaExceeded as e:
+        print(f"Quota exceeded => {e}")
+        return 403
+
+    except HTTPError as e:
+        reason = get_error_reason(e)
+        if e.code == 403 and reason in QUOTA_REASONS:
+            print(f"HTTP ERROR 403 [{reason}] => the API reached the " \
+                  "maximum allowed requests.")
+            return 403
+        if e.code in (403, 404):
+            print(f"HTTP ERROR {e.code} [{reason}] => skipping the video.")
+            return None
+        print("Something went wrong:", e)
+        print(f"Successfully retrieved [{comment_count}] comments.")
+
+    except Exception as e:
+        print("Something went wrong:", e)
+        print(f"Successfully retrieved [{comment_count}] comments.")
+
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
 
     return video_info
 
+def get_youtube_replies(parent_id: str, 
+                        api_key: str, 
+                        key_pool: ApiKeyPool | None=None,
+                        base_url: str=API_URL) -> List[Dict[str, str]]:
+    """Return all replies of a comment thread, following <nextPageToken> past
+    the first 100 replies."""
+    params = {
+        'key': api_key, 
+        'textFormat': 'plainText',
+        'part': 'snippet', 
+        'parentId': parent_id, 
+        'maxResults': 100,
+        'fields': REPLY_FIELDS,
+    }
+    replies = list()
+
+    while True:
+        response_replies = fetch_resource('comments', params, key_pool, 
+                                          base_url)
+        replies.extend(get_reply_info(reply) 
+                       for reply in response_replies['items'])
+
+        if 'nextPageToken' not in response_replies:
+            return replies
+        params['pageToken'] = response_replies['nextPageToken']
+
+def fetch_resource(resource: str, 
+                   params: Dict, 
+                   key_pool: ApiKeyPool | None=None,
+                   base_url: str=API_URL) -> Dict:
+    """Charge the request to the key in <params> and send it."""
+    if key_pool:
+        key_pool.spend(params['key'], resource)
+    return fetch_json(resource, params, base_url)
+
+def get_error_reason(error: HTTPError) -> str | None:
+    """Return error.errors[0].reason of an API error response."""
+    try:
+        body = json.loads(error.read())
+        return body['error']['errors'][0]['reason']
+    except (ValueError, KeyError, IndexError, TypeError):
+        return None
+
+def get_reply_info(reply: Dict) -> Dict[str, str]:
+    return {
+        'reply_id': reply['id'],
+        'reply_published_at': reply['snippet']['publishedAt'],
+        'reply_text_display': reply['snippet']['textDisplay'],
+    }
+
+def get_checkpoint_path(video_id: str) -> str:
+    return f"{CHECKPOINT_DIR}/{video_id}.jsonl"
+
+def save_checkpoint(video_id: str, 
+                    page_token: str | None, 
+                    page_comments: List[Dict]) -> None:
+    """Append the comments of a finished page and the token of the page after
+    it to the checkpoint of a video. A line cut short by a crash is removed by
+    <load_checkpoint> before anything is appended again, so that page is just
+    fetched again."""
+    os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+    line = json.dumps({'page_token': page_token, 'comments': page_comments})
+    with open(get_checkpoint_path(video_id), 'a') as file:
+        file.write(line + "\n")
+        file.flush()
+        os.fsync(file.fileno())
+
+def parse_checkpoint_line(line: str) -> Dict | None:
+    """Return the page of a checkpoint line, or None if it's broken.
+
+    Before broken lines were removed, a page appended after a line cut short
+    ended up on the same line, so the last page that starts on it is tried
+    as well.
+    """
+    start = 0
+    while start != -1:
+        try:
+            page = json.loads(line[start:])
+            if isinstance(page, dict) and 'comments' in page:
+                return page
+        except json.JSONDecodeError:
+            pass
+        start = line.find('{"page_token":', start + 1)
+    return None
+
+def load_checkpoint(video_id: str) -> Dict | None:
+    """Return the comments saved so far for a video and the token of the
+    page to continue with, or None if there is no checkpoint.
+
+    Broken lines are skipped, the token is the one of the last good page and
+    comments saved twice are kept once. If anything was skipped, the file is
+    rewritten with only the good pages, so the next page is never appended
+    to a line cut short.
+    """
+    filename = get_checkpoint_path(video_id)
+    if not os.path.exists(filename):
+        return None
+
+    checkpoint = {'page_token': None, 'comments': []}
+    pages = list()
+    comment_ids = set()
+    clean = True
+    with open(filename, 'r') as file:
+        for line in file:
+            page = parse_checkpoint_line(line)
+            if page is None:
+                clean = False
+                continue
+
+            comments = list()
+            for comment in page['comments']:
+                if comment.get('comment_id') in comment_ids:
+                    continue
+                if comment.get('comment_id') is not None:
+                    comment_ids.add(comment['comment_id'])
+                comments.append(comment)
+
+            page = {'page_token': page['page_token'], 'comments': comments}
+            # lines are written by json.dumps, anything else was repaired
+            clean = clean and json.dumps(page) + "\n" == line
+            pages.append(page)
+            checkpoint['page_token'] = page['page_token']
+            checkpoint['comments'].extend(comments)
+
+    if not clean:
+        with open(f"{filename}.tmp", 'w') as file:
+            for page in pages:
+                file.write(json.dumps(page) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(f"{filename}.tmp", filename)
+
+    return checkpoint if checkpoint['comments'] else None
+
+def delete_checkpoint(video_url: str) -> None:
+    filename = get_checkpoint_path(get_video_id_from_video_url(video_url))
+    if os.path.exists(filename):
+        os.remove(filename)
+
 def get_api_key() -> List[str]:
     api_key = open(f"{YOUTUBE_DATA_DIR}/youtube_api_key.txt").readlines()
-    return [x.split(";")[0] for x in api_key]
+    return [x.split(";")[0].strip() for x in api_key if x.strip()]
 
 def get_next_free_api_key() -> str | None:
     for key in get_api_key(): 
@@ -144,40 +369,16 @@ def get_next_free_api_key() -> str | None:
             return key
     return None
 
-def set_api_key_as_visited(visited_api_key: str, 
-                           filename: str=f"{YOUTUBE_DATA_DIR}/youtube_api_key.txt") -> None:
-    """Set a given api key as visited."""
-    print("Set the api key as visited... ", end="")
-    with open(filename, 'r') as file:
-        lines = file.readlines()
-
-    for idx, line in enumerate(lines):
-        current_api_key = line.split(";")[0].strip()
-        if current_api_key == visited_api_key:
-            lines[idx] = f'#{lines[idx]}'
-            break
-
-    with open(filename, 'w') as file:
-        file.writelines(lines)
-    print("OK")
-
-def set_all_api_key_as_unvisited(filename: str=f'{YOUTUBE_DATA_DIR}/youtube_api_key.txt') -> None:
-    """Set all api keys as unvisited."""
-    with open(filename, 'r') as file:
-        lines = file.readlines()
-
-    for idx, line in enumerate(lines):
-        if line.startswith("#"):
-            lines[idx] = line.replace("#", "")
-    
-    with open(filename, 'w') as file:
-        file.writelines(lines)
-
 def get_unvisited_videos(filename: str=f'{YOUTUBE_DATA_DIR}/youtube_video.txt') -> List[str]:
     with open(filename, 'r') as file: 
         lines = file.readlines()
     return [line.strip() for line in lines if not line.startswith('#')]
 
+def get_visited_videos(filename: str=f'{YOUTUBE_DATA_DIR}/youtube_video.txt') -> List[str]:
+    with open(filename, 'r') as file: 
+        lines = file.readlines()
+    return [line.strip().lstrip('#') for line in lines if line.startswith('#')]
+
 def get_video_id_from_video_url(video_url: str) -> str: 
     return video_url.strip().split('=')[-1]
 
@@ -198,21 +399,6 @@ def set_video_as_visited(video_url: str,
         file.writelines(lines)
     print("OK")
 
-def save_comments_to_json(new_data: dict, 
-                          filename: str=f'{YOUTUBE_DATA_DIR}/data.json') -> None:
-    """Save extracted comments in a json file."""
-    print("Saving comments to json... ", end="")
-    if not os.path.exists(filename):
-        with open(filename, 'w') as f:
-            json.dump([], f)
-
-    with open(filename, 'r+') as file:
-        file_data = json.load(file)
-        file_data.append(new_data)
-        file.seek(0)
-        json.dump(file_data, file, indent=4)
-        print("OK")
-
 def delete_duplicate_youtube_url():
     """Search for duplicate URLs in the youtube_videos.txt file and keep first 
     occurrence. Reasoning: while adding new URLs manually, it might occur that
@@ -223,33 +409,103 @@ def delete_duplicate_youtube_url():
     # 2. 
     pass
 
-def main():
-    while True:
-        api_key = get_next_free_api_key()
+def extraction_worker(api_key: str, 
+                      key_pool: ApiKeyPool, 
+                      video_queue: Queue,
+                      latest_comment_dates: Dict[str, str] | None=None) -> None:
+    """Extract videos from the queue with one key until the queue is empty or
+    the key ran out of quota.
+
+    With <latest_comment_dates> the videos are refreshed, i.e. only comments
+    newer than the stored ones are retrieved and appended to the store.
+    """
+    while key_pool.is_live(api_key):
+        try:
+            video_url = video_queue.get_nowait()
+        except Empty:
+            return
+
+        print("\nURL", video_url)
+        newer_than = None
+        if latest_comment_dates is not None:
+            newer_than = latest_comment_dates.get(video_url)
+        new_data = get_youtube_comments(video_url, 
+                                        api_key=api_key, 
+                                        key_pool=key_pool,
+                                        newer_than=newer_than)
+
+        if new_data is None:
+            # comments disabled, private or deleted, the key is fine
+            if latest_comment_dates is None:
+                with _video_file_lock:
+                    set_video_as_visited(video_url)
+            delete_checkpoint(video_url)
+            key_pool.save()
+            continue
+
+        if new_data == 403:
+            print(f"Giving the video back to the queue... new_data=[{new_data}]")
+            key_pool.retire(api_key)
+            video_queue.put(video_url)
+            key_pool.save()
+            return
+
+        if latest_comment_dates is None:
+            save_video(new_data)
+            with _video_file_lock:
+                set_video_as_visited(video_url)
+        elif new_data['video_comment']:
+            print(f"Found [{len(new_data['video_comment'])}] new comments.")
+            save_video(new_data)
+        delete_checkpoint(video_url)
+        key_pool.save()
+
+def main(refresh: bool=False, wait: bool=True):
+    """Run one extraction worker per api key that has quota left today.
+
+    With <refresh> the already visited videos are crawled again for the
+    comments that were posted since they were stored. With <wait> the run
+    sleeps until the quota resets whenever all keys are spent and videos are
+    left, instead of stopping.
+    """
+    key_pool = ApiKeyPool([key.lstrip("#") for key in get_api_key()])
+    latest_comment_dates = None
+    if refresh:
+        unvisited_videos = get_visited_videos()
+        latest_comment_dates = get_latest_comment_dates()
+    else:
         unvisited_videos = get_unvisited_videos()   
 
-        if not api_key: 
-            print("There is no api key available.")
-            sys.exit()
-        elif not unvisited_videos: 
-            print("There is no unvisited videos.")
-            sys.exit()
+    if not unvisited_videos: 
+        print("There is no unvisited videos.")
+        sys.exit()
 
-        for video_url in unvisited_videos:
-            print("\nURL", video_url)
-            new_data = get_youtube_comments(video_url, api_key=api_key)
-        
-            # BUG: handle videos with comment section deactivated
-            # BUG: handle videos that are private
+    video_queue = Queue()
+    for video_url in unvisited_videos:
+        video_queue.put(video_url)
 
-            if new_data == 403:
-                print(f"Skipping to next iteration... new_data=[{new_data}]")
-                set_api_key_as_visited(api_key)
-                break
+    while True:
+        live_keys = key_pool.get_live_keys()
+        if live_keys:
+            print(f"Starting [{len(live_keys)}] extraction workers.")
+            with ThreadPoolExecutor(max_workers=len(live_keys)) as workers:
+                for future in [workers.submit(extraction_worker, api_key, 
+                                              key_pool, video_queue, 
+                                              latest_comment_dates) 
+                               for api_key in live_keys]:
+                    future.result()
+            print(f"Units spent today: {key_pool.get_usage()}")
+
+        if video_queue.empty():
+            break
 
-            save_comments_to_json(new_data)
-            set_video_as_visited(video_url)
+        seconds_until_reset = key_pool.get_seconds_until_reset()
+        print(f"[{video_queue.qsize()}] videos left. Quota resets in " \
+              f"[{seconds_until_reset / 3600:.1f}h].")
+        if not wait:
+            break
+        time.sleep(seconds_until_reset + 60)
 
 if __name__ == "__main__":
     # set_api_key_as_unvisited()
-    main()
\ No newline at end of file
+    main(refresh="--refresh" in sys.argv, wait="--no-wait" not in sys.argv)
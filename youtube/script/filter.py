@@ -1,48 +1,132 @@
-import os
+from typing import Dict, Iterable, Iterator, List
 import pandas as pd
+from dataset import INGESTED_COLUMN, YEARS, dataset_exists, delete_dataset, \
+                    get_dataset_columns, get_ingestion_time, read_dataset, \
+                    replace_dataset, write_dataset
 from extract import get_video_id_from_video_url
-from functions import get_youtube_data
+from storage import get_comment_key, get_reply_key, get_row_id, iter_videos
 
-def main():
-    docs = get_youtube_data()
-    all_comments = list()
-    year = ("2020", "2021", "2022")
+MIN_VIDEO_COMMENTS = 20
+FILTERED_COLUMNS = ["url", "channel", "comment_id", "date", "comment"]
+# where <main> writes data_filtered until it is complete
+FILTERED_STAGING = "data_filtered.staging"
+BATCH_SIZE = 200000
+
+def iter_comment_batches(docs: Iterable[Dict],
+                         batch_size: int=BATCH_SIZE) -> Iterator[pd.DataFrame]:
+    """Flatten videos, comments and replies into DataFrames of about
+    <batch_size> rows. Besides the comment itself every row carries what the
+    filters need: the video date, the number of comments of the video and the
+    date of the comment a reply belongs to."""
+    columns = ["url", "channel", "video_date", "video_comment_count",
+               "parent_date", "comment_id", "date", "comment"]
+    batch = {column: [] for column in columns}
 
     for doc in docs:
-        video_url = doc["video_url"]
-        video_url = get_video_id_from_video_url(video_url)
-        video_date = doc["video_published_at"][:10]
+        video_url = get_video_id_from_video_url(doc["video_url"])
+        video_date = doc["video_published_at"]
         video_channel = doc["video_channel_title"]
+        video_comment_count = len(doc["video_comment"])
         # video_title = doc["video_title"]
 
-        if video_date.startswith(year) and len(doc["video_comment"]) >= 20:
-            for comment in doc["video_comment"]:
-                comment_text = comment["comment_text_display"]
-                comment_date = comment["comment_published_at"][:10]
-
-                if comment_date.startswith(year):
-                    all_comments.append(
-                        (video_url, video_channel, comment_date, comment_text)
-                    )
-                    
-                    if comment["comment_reply"]:
-                        for reply in comment["comment_reply"]:
-                            reply_text = reply["reply_text_display"]
-                            reply_date = reply["reply_published_at"][:10]
-
-                            if reply_date.startswith(year):
-                                all_comments.append(
-                                    (video_url, 
-                                     video_channel, 
-                                     reply_date, 
-                                     reply_text)
-                                )
-    
-    df = pd.DataFrame(all_comments, 
-                      columns=["url", "channel", "date", "comment"])
-    df.to_pickle(f"/home/{os.getlogin()}/Desktop/bachelor_thesis/" \
-                  "youtube/data/data_filtered.pkl")
-       
+        for comment in doc["video_comment"]:
+            comment_date = comment["comment_published_at"]
+            # records from before the ids were kept get one from their content
+            comment_key = get_comment_key(comment)
+            rows = [(get_row_id(doc, comment_key), comment_date,
+                     comment["comment_text_display"])]
+            rows += [(get_row_id(doc, comment_key, get_reply_key(reply)),
+                      reply["reply_published_at"], reply["reply_text_display"])
+                     for reply in comment["comment_reply"]]
+
+            for comment_id, date, text in rows:
+                batch["url"].append(video_url)
+                batch["channel"].append(video_channel)
+                batch["video_date"].append(video_date)
+                batch["video_comment_count"].append(video_comment_count)
+                batch["parent_date"].append(comment_date)
+                batch["comment_id"].append(comment_id)
+                batch["date"].append(date)
+                batch["comment"].append(text)
+
+        if len(batch["comment"]) >= batch_size:
+            yield pd.DataFrame(batch)
+            batch = {column: [] for column in columns}
+
+    if batch["comment"]:
+        yield pd.DataFrame(batch)
+
+def is_in_years(dates: pd.Series, years: List[str] | None) -> pd.Series:
+    """Whether the dates are from <years>, from the first of YEARS on if
+    None."""
+    if years is None:
+        return dates.str[:4] >= YEARS[0]
+    return dates.str[:4].isin(years)
+
+def filter_comments(df: pd.DataFrame,
+                    years: List[str] | None=YEARS) -> pd.DataFrame:
+    """Keep comments and replies from the given years whose video is from
+    these years too and has enough comments. Replies also need their comment
+    to be from these years."""
+    mask = (
+        is_in_years(df["video_date"], years)
+        & (df["video_comment_count"] >= MIN_VIDEO_COMMENTS)
+        & is_in_years(df["parent_date"], years)
+        & is_in_years(df["date"], years)
+    )
+    df = df.loc[mask, FILTERED_COLUMNS]
+    return df.assign(date=df["date"].str[:10])
+
+def append_new_comments(ingested_at: str) -> pd.DataFrame:
+    """Append the comments of the store that aren't in data_filtered yet,
+    replies to old threads and comments of new videos included, from any
+    year since the first of YEARS, and return them. They are told apart by
+    their id, not their date, so comments posted later on an already
+    ingested day are found too."""
+    known_ids = set(read_dataset("data_filtered", columns=["comment_id"])
+                    ["comment_id"].tolist())
+    new_rows = list()
+    for batch in iter_comment_batches(iter_videos()):
+        df = filter_comments(batch, years=None)
+        df = df[~df["comment_id"].isin(known_ids)]
+        known_ids.update(df["comment_id"].tolist())
+        new_rows.append(df)
+
+    df = pd.concat(new_rows, ignore_index=True) if new_rows \
+         else pd.DataFrame(columns=FILTERED_COLUMNS)
+    df[INGESTED_COLUMN] = ingested_at
+    if len(df):
+        write_dataset(df, "data_filtered", append=True)
+    return df
+
+def can_update() -> bool:
+    """Whether data_filtered was written with the comment ids and ingestion
+    times an update needs."""
+    return dataset_exists("data_filtered") and \
+           {"comment_id", INGESTED_COLUMN} <= set(get_dataset_columns("data_filtered"))
+
+def main():
+    """Filter the store batch by batch into data_filtered. The batches are
+    written to FILTERED_STAGING and swapped in together at the end."""
+    docs = iter_videos()
+    ingested_at = get_ingestion_time()
+    delete_dataset(FILTERED_STAGING)
+    written = False
+
+    for batch in iter_comment_batches(docs):
+        df = filter_comments(batch)
+        if len(df):
+            df[INGESTED_COLUMN] = ingested_at
+            write_dataset(df, FILTERED_STAGING, append=written)
+            written = True
+
+    if written:
+        replace_dataset("data_filtered", FILTERED_STAGING)
+    else:
+        # an old data_filtered would otherwise pass for the current one
+        delete_dataset("data_filtered")
+        print("No comment passed the filters, [data_filtered] removed. ", end="")
+
 if __name__ == "__main__":
     print("Filtering comments... ", end="")
     main()
@@ -4,12 +4,17 @@ from tqdm import tqdm
 from googleapiclient.discovery import build
 from extract import get_next_free_api_key
 from extract import get_video_id_from_video_url
+from storage import YOUTUBE_STORE_DIR, iter_videos
 
 YOUTUBE_DATA_PATH = f"/home/{os.getlogin()}/Desktop/bachelor_thesis/youtube/data/data.json"
 
-def get_youtube_data(file_path: str=YOUTUBE_DATA_PATH):
-    """Open the file containing youtube data."""     
-    with open(file_path, 'r') as file: return json.load(file) 
+def get_youtube_data(file_path: str=YOUTUBE_STORE_DIR):
+    """Stream the videos of the store one at a time, with the records of
+    refreshed or re-crawled videos merged. A path to a .json file is still
+    loaded as a whole, as it was before the store existed."""
+    if file_path.endswith(".json"):
+        with open(file_path, 'r') as file: return json.load(file)
+    return iter_videos(file_path)
 
 def set_youtube_data(docs: json, 
                      file_path: str=YOUTUBE_DATA_PATH):
@@ -86,14 +91,14 @@ def delete_json_entry_by_index(indexes: list,
         indexes (list): a list containing the indexes of the entries to be deleted.
     """
 
-    data = get_youtube_data(file_path=file_path)
+    data = list(get_youtube_data(file_path=file_path))
 
     invalid_indexes = [i for i in indexes if i < 0 or i >= len(data)]
     if not invalid_indexes:
         for index in sorted(indexes, reverse=True):
             del data[index]
 
-        set_youtube_data(data)
+        set_youtube_data(data, file_path=file_path)
 
         print(f"Entry at indexes {indexes} deleted successfully.")
     else:
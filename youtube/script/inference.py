@@ -0,0 +1,112 @@
+import os
+import sys
+from typing import List, Tuple
+import numpy as np
+from tqdm import tqdm
+from bertopic import BERTopic
+from sentence_transformers import SentenceTransformer
+from dataset import YEARS, delete_dataset, iter_preprocessed, write_dataset
+from embedding import encode, get_embedding_name, load_embedding_model
+from embedding_cache import EmbeddingCache
+from process import ONLINE_MODEL_FILE, get_model_backend, get_model_dir
+
+INFERENCE_CHUNK_SIZE = 100000
+
+def load_topic_model(name: str, 
+                     embedding_model: SentenceTransformer) -> BERTopic:
+    """Load a model saved by process.save_topic_model or online.py once, with
+    the already loaded <embedding_model> instead of the one named in the
+    model files."""
+    model_path = f"{get_model_dir(name)}/{ONLINE_MODEL_FILE}"
+    if not os.path.exists(model_path):
+        model_path = get_model_dir(name)
+    return BERTopic.load(model_path, embedding_model=embedding_model)
+
+def assign_topics(topic_model: BERTopic,
+                  embedding_model: SentenceTransformer,
+                  docs: List[str],
+                  embedding_cache: EmbeddingCache,
+                  backend: str="auto",
+                  chunk_size: int=INFERENCE_CHUNK_SIZE) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the topic of every doc and the probability of that topic.
+
+    The docs are embedded, looked up in the cache first, and transformed in
+    chunks of <chunk_size>. A model loaded from safetensors has no UMAP or
+    HDBSCAN, it assigns each doc the topic with the most similar embedding
+    and that similarity as probability. The k-means of online.py gives no
+    probabilities, they are NaN then.
+    """
+    topics = np.empty(len(docs), dtype=np.int32)
+    probabilities = np.empty(len(docs), dtype=np.float32)
+
+    for start in tqdm(range(0, len(docs), chunk_size), desc="assign_topics"):
+        chunk = docs[start:start + chunk_size]
+        embeddings = embedding_cache.get_embeddings(
+            chunk, lambda texts: encode(embedding_model, texts, backend=backend)
+        )
+        chunk_topics, chunk_probabilities = topic_model.transform(chunk, embeddings)
+
+        topics[start:start + len(chunk)] = chunk_topics
+        if chunk_probabilities is None:
+            probabilities[start:start + len(chunk)] = np.nan
+            continue
+        chunk_probabilities = np.asarray(chunk_probabilities)
+        if chunk_probabilities.ndim == 2:
+            chunk_probabilities = chunk_probabilities.max(axis=1)
+        probabilities[start:start + len(chunk)] = chunk_probabilities
+    return topics, probabilities
+
+def main(name: str,
+         token_count: int=10,
+         since: str | None=None,
+         backend: str="auto",
+         batch_size: int=INFERENCE_CHUNK_SIZE) -> None:
+    """Assign the topics of the saved model <name> to the preprocessed
+    comments, only to the ones after <since> (YYYY-MM-DD) if given, and save
+    them as the dataset <name>_topics. The comments are read, assigned and
+    written <batch_size> at a time.
+
+    backend: "auto" embeds with the backend the model was trained with, see
+             process.get_model_backend
+    """
+    filters = [("lang", "==", "pt")]
+    if since is not None:
+        filters += [("year", ">=", since[:4]), ("date", ">", since)]
+
+    backend = get_model_backend(name, backend)
+    embedding_model = load_embedding_model(backend)
+    topic_model = load_topic_model(name, embedding_model)
+    embedding_cache = EmbeddingCache(get_embedding_name(backend))
+
+    n_comments = 0
+    # comments after <since> may be from years the analysis doesn't cover
+    for df in iter_preprocessed(min_tokens=token_count,
+                                columns=["url", "channel", "date", "comment"],
+                                filters=filters,
+                                years=None if since is not None else YEARS,
+                                batch_size=batch_size):
+        print(f"Assigning topics of [{name}] to comments " \
+              f"[{n_comments}:{n_comments + len(df)}]...")
+        topics, probabilities = assign_topics(
+            topic_model, embedding_model, df["comment"].astype(str).tolist(),
+            embedding_cache, backend, chunk_size=batch_size
+        )
+        write_dataset(df.assign(topic=topics, probability=probabilities),
+                      f"{name}_topics", append=n_comments > 0)
+        n_comments += len(df)
+
+    if not n_comments:
+        # an old <name>_topics would otherwise pass for this selection
+        delete_dataset(f"{name}_topics")
+    print(f"Assigned topics of [{name}] to [{n_comments}] comments.")
+
+if __name__ == "__main__":
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    # e.g. python inference.py data_processed_10_tokens 10 --since=2022-06-30
+    options = dict(arg[2:].split("=", 1) for arg in sys.argv[1:]
+                   if arg.startswith("--") and "=" in arg)
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    main(name=args[0] if args else "data_processed_10_tokens",
+         token_count=int(args[1]) if len(args) > 1 else 10,
+         since=options.get("since"),
+         backend=options.get("backend", "auto"))
@@ -0,0 +1,144 @@
+import os
+from typing import List, Tuple
+import numpy as np
+from umap.umap_ import nearest_neighbors
+from embedding_cache import get_text_hash, save_array
+
+YOUTUBE_DATA_DIR = f"/home/{os.getlogin()}/Desktop/bachelor_thesis/youtube/data"
+KNN_CACHE_DIR = f"{YOUTUBE_DATA_DIR}/knn_cache"
+# neighbours kept per doc, more than UMAP asks for so that a subset of the
+# docs still finds enough of them among its own
+STORED_NEIGHBORS = 30
+# if more of the subset than this lacks neighbours, a new graph is built
+# instead of searching the rows one by one, each of them is compared with
+# every doc
+MAX_RECOMPUTE_RATIO = 0.1
+# bytes the exact search may hold per chunk: the similarities (float32) and
+# their argpartition (int64) of every row in it against all docs
+EXACT_SEARCH_MEMORY = 512 * 1024 ** 2
+
+def build_knn_graph(embeddings: np.ndarray,
+                    n_neighbors: int=STORED_NEIGHBORS) -> Tuple[np.ndarray, np.ndarray]:
+    """Approximate cosine kNN graph the same way UMAP builds it internally,
+    every row starting with the doc itself. The graph is saved, so it runs
+    unseeded on all cores."""
+    indices, distances, _ = nearest_neighbors(embeddings,
+                                              n_neighbors=n_neighbors,
+                                              metric="cosine",
+                                              metric_kwds={},
+                                              angular=False,
+                                              random_state=None,
+                                              n_jobs=-1,
+                                              verbose=True)
+    return indices.astype(np.int32), distances.astype(np.float32)
+
+def get_chunk_size(n_docs: int, memory: int=EXACT_SEARCH_MEMORY) -> int:
+    """Rows per chunk of <search_exact> so that a chunk stays within <memory>
+    bytes, 12 of them per row and doc."""
+    return max(1, memory // (12 * n_docs))
+
+def search_exact(embeddings: np.ndarray,
+                 rows: np.ndarray,
+                 n_neighbors: int,
+                 chunk_size: int | None=None) -> Tuple[np.ndarray, np.ndarray]:
+    """Exact cosine neighbours of the given rows among all <embeddings>, in
+    chunks of <chunk_size> rows, by default sized by <get_chunk_size>."""
+    chunk_size = chunk_size or get_chunk_size(len(embeddings))
+    normalized = embeddings / np.maximum(
+        np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12
+    )
+    normalized = normalized.astype(np.float32, copy=False)
+    indices = np.empty((len(rows), n_neighbors), dtype=np.int32)
+    distances = np.empty((len(rows), n_neighbors), dtype=np.float32)
+
+    for start in range(0, len(rows), chunk_size):
+        similarity = normalized[rows[start:start + chunk_size]] @ normalized.T
+        nearest = np.argpartition(similarity, -n_neighbors, axis=1)[:, -n_neighbors:]
+        nearest_similarity = np.take_along_axis(similarity, nearest, axis=1)
+        order = np.argsort(-nearest_similarity, axis=1)
+        indices[start:start + chunk_size] = np.take_along_axis(nearest, order, axis=1)
+        distances[start:start + chunk_size] = 1 - np.take_along_axis(
+            nearest_similarity, order, axis=1
+        )
+    return indices, np.maximum(distances, 0)
+
+class KnnGraphCache:
+    """The cosine kNN graph of the largest doc set seen so far, stored with
+    the text hashes of its rows, so UMAP gets its neighbours precomputed for
+    that set and every subset of it, e.g. the token thresholds of
+    process.py, across runs.
+
+    files: <name>.keys.npy, <name>.indices.npy, <name>.distances.npy
+    """
+    def __init__(self, embedding_name: str, cache_dir: str=KNN_CACHE_DIR):
+        self.path = f"{cache_dir}/{embedding_name.replace('/', '__')}"
+        self.keys = None
+        self.indices = None
+        self.distances = None
+
+        os.makedirs(cache_dir, exist_ok=True)
+        if os.path.exists(f"{self.path}.keys.npy"):
+            self.keys = np.load(f"{self.path}.keys.npy")
+            self.indices = np.load(f"{self.path}.indices.npy", mmap_mode="r")
+            self.distances = np.load(f"{self.path}.distances.npy", mmap_mode="r")
+
+    def save(self, keys: np.ndarray, indices: np.ndarray, distances: np.ndarray) -> None:
+        # keys last, they mark the graph as complete
+        save_array(f"{self.path}.indices.npy", indices)
+        save_array(f"{self.path}.distances.npy", distances)
+        save_array(f"{self.path}.keys.npy", keys)
+        self.keys, self.indices, self.distances = keys, indices, distances
+
+    def get_rows(self, keys: np.ndarray) -> np.ndarray:
+        """Row of every key in the stored graph, -1 if it isn't in it."""
+        if self.keys is None:
+            return np.full(len(keys), -1)
+        row_by_key = {key: row for row, key in enumerate(self.keys.tolist())}
+        return np.array([row_by_key.get(key, -1) for key in keys.tolist()])
+
+    def get(self,
+            texts: List[str],
+            embeddings: np.ndarray,
+            n_neighbors: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the kNN indices and distances of <texts>, as expected by
+        UMAP(precomputed_knn=...).
+
+        If all <texts> are in the stored graph, each keeps the stored graph's
+        neighbours within <texts>, as approximate as the NN-descent graph
+        they come from. Docs left with fewer than <n_neighbors> are searched
+        exactly, unless they are more than MAX_RECOMPUTE_RATIO of them.
+        Otherwise the graph is built anew and stored if it covers more docs
+        than the old one.
+        """
+        keys = np.array([get_text_hash(text) for text in texts], dtype="U32")
+        rows = self.get_rows(keys)
+
+        if (rows >= 0).all() and n_neighbors <= self.indices.shape[1]:
+            position_by_row = np.full(len(self.keys), -1)
+            position_by_row[rows] = np.arange(len(rows))
+
+            candidates = self.indices[rows]
+            candidates = np.where(candidates >= 0,
+                                  position_by_row[np.maximum(candidates, 0)], -1)
+            valid = candidates >= 0
+            # the valid neighbours first, each row still sorted by distance
+            order = np.argsort(~valid, axis=1, kind="stable")[:, :n_neighbors]
+            indices = np.take_along_axis(candidates, order, axis=1).astype(np.int32)
+            distances = np.take_along_axis(self.distances[rows], order, axis=1)
+
+            missing = np.flatnonzero(valid.sum(axis=1) < n_neighbors)
+            print(f"kNN graph: restricted [{len(texts)}] docs from the stored " \
+                  f"graph, [{len(missing)}] of them lack neighbours.")
+            if len(missing) <= MAX_RECOMPUTE_RATIO * len(texts):
+                if len(missing):
+                    indices[missing], distances[missing] = search_exact(
+                        embeddings, missing, n_neighbors
+                    )
+                return indices, distances
+
+        print(f"kNN graph: building it for [{len(texts)}] docs...")
+        indices, distances = build_knn_graph(embeddings,
+                                             max(n_neighbors, STORED_NEIGHBORS))
+        if self.keys is None or len(keys) > len(self.keys):
+            self.save(keys, indices, distances)
+        return indices[:, :n_neighbors], distances[:, :n_neighbors]
@@ -1,11 +1,133 @@
 import os
-import sys
+import hashlib
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Dict, List
 import pandas as pd
 import matplotlib.pyplot as plt
-from langdetect import detect
+from langdetect import DetectorFactory, detect
+from langdetect.lang_detect_exception import LangDetectException
 from tqdm import tqdm
+from dataset import PREPROCESSED_DATASET, TOKEN_THRESHOLDS, get_dataset_columns, \
+                    read_dataset, write_preprocessed
 
 YOUTUBE_DATA_DIR = f"/home/{os.getlogin()}/Desktop/bachelor_thesis/youtube/data"
+LANGUAGE_CACHE_PATH = f"{YOUTUBE_DATA_DIR}/language_cache.sqlite"
+# https://fasttext.cc/docs/en/language-identification.html
+FASTTEXT_MODEL_PATH = f"{YOUTUBE_DATA_DIR}/lid.176.ftz"
+LANGUAGE_SEED = 0
+UNKNOWN_LANGUAGE = "unknown"
+
+_fasttext_model = None
+
+def init_language_worker() -> None:
+    """langdetect is random unless seeded, the seed is read every time a
+    detector is created."""
+    DetectorFactory.seed = LANGUAGE_SEED
+
+def detect_with_langdetect(texts: List[str]) -> List[str]:
+    languages = list()
+    for text in texts:
+        try:
+            languages.append(detect(text))
+        except LangDetectException:
+            languages.append(UNKNOWN_LANGUAGE)
+    return languages
+
+def detect_with_fasttext(texts: List[str]) -> List[str]:
+    """Classify with the compressed fastText model, which runs offline and is
+    much faster than langdetect. Needs <pip install fasttext> and the model
+    file at FASTTEXT_MODEL_PATH."""
+    global _fasttext_model
+    if _fasttext_model is None:
+        import fasttext
+        _fasttext_model = fasttext.load_model(FASTTEXT_MODEL_PATH)
+
+    labels, _ = _fasttext_model.predict([" ".join(text.split()) 
+                                         for text in texts])
+    return [label[0].replace("__label__", "") if label else UNKNOWN_LANGUAGE 
+            for label in labels]
+
+LANGUAGE_BACKENDS = {
+    "langdetect": detect_with_langdetect,
+    "fasttext": detect_with_fasttext,
+}
+
+def detect_batch(backend: str, texts: List[str]) -> List[str]:
+    return LANGUAGE_BACKENDS[backend](texts)
+
+def get_text_hash(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+def open_language_cache(cache_path: str=LANGUAGE_CACHE_PATH) -> sqlite3.Connection:
+    connection = sqlite3.connect(cache_path)
+    connection.execute("CREATE TABLE IF NOT EXISTS language ("
+                       "text_hash TEXT, backend TEXT, lang TEXT, "
+                       "PRIMARY KEY (text_hash, backend))")
+    return connection
+
+def get_cached_languages(connection: sqlite3.Connection, 
+                         backend: str, 
+                         text_hashes: List[str]) -> Dict[str, str]:
+    cached = dict()
+    for start in range(0, len(text_hashes), 500):
+        chunk = text_hashes[start:start + 500]
+        cached.update(connection.execute(
+            "SELECT text_hash, lang FROM language WHERE backend = ? AND "
+            f"text_hash IN ({','.join('?' * len(chunk))})", 
+            [backend, *chunk]
+        ))
+    return cached
+
+def detect_languages(texts: List[str],
+                     backend: str="langdetect",
+                     n_process: int | None=None,
+                     batch_size: int=2000,
+                     cache_path: str=LANGUAGE_CACHE_PATH) -> List[str]:
+    """Return the ISO-639 code of the language of every text.
+
+    Texts already classified by <backend> are taken from the cache, which is
+    keyed by the hash of the text. The rest is classified in batches on
+    <n_process> processes (all cores by default) and every finished batch is
+    written to the cache, so an interrupted run continues where it stopped.
+    """
+    text_hashes = [get_text_hash(text) for text in texts]
+    connection = open_language_cache(cache_path)
+    languages = get_cached_languages(connection, backend, 
+                                     list(set(text_hashes)))
+
+    missing = dict()
+    for text_hash, text in zip(text_hashes, texts):
+        if text_hash not in languages:
+            missing[text_hash] = text
+    print(f"[{len(set(text_hashes)) - len(missing)}] distinct texts cached, " \
+          f"[{len(missing)}] to classify with [{backend}].")
+
+    missing_hashes = list(missing.keys())
+    missing_texts = list(missing.values())
+    batches = [missing_texts[start:start + batch_size] 
+               for start in range(0, len(missing_texts), batch_size)]
+
+    with ProcessPoolExecutor(max_workers=n_process, 
+                             initializer=init_language_worker) as executor:
+        results = executor.map(partial(detect_batch, backend), batches)
+        for start, batch_languages in zip(
+            tqdm(range(0, len(missing_texts), batch_size), 
+                 desc="Detecting language"), 
+            results
+        ):
+            batch_hashes = missing_hashes[start:start + batch_size]
+            languages.update(zip(batch_hashes, batch_languages))
+            connection.executemany(
+                "INSERT OR REPLACE INTO language VALUES (?, ?, ?)",
+                [(text_hash, backend, lang) 
+                 for text_hash, lang in zip(batch_hashes, batch_languages)]
+            )
+            connection.commit()
+
+    connection.close()
+    return [languages[text_hash] for text_hash in text_hashes]
 
 def create_language_distribution(token: int, df: pd.DataFrame):
     file_path = f"/home/{os.getlogin()}/Desktop/bachelor_thesis" \
@@ -40,25 +162,25 @@ def create_language_distribution(token: int, df: pd.DataFrame):
     # plt.show()
 
 def main():
-    file_path = f"{YOUTUBE_DATA_DIR}/data_preprocessed_1_tokens.pkl"
-    df = pd.read_pickle(file_path)
+    """Detect the language of the preprocessed comments and plot its
+    distribution. If [lang] already exists, e.g. from language_gate.py, only
+    the plots are drawn."""
+    name = PREPROCESSED_DATASET
 
-    if "lang" in df.columns.tolist():
-        print("Column [lang] already exists. Closing...")
-        sys.exit()
+    if "lang" in get_dataset_columns(name):
+        print("Column [lang] already exists, drawing the plots only.")
+        df = read_dataset(name, columns=["lang", "token_count"])
+    else:
+        df = read_dataset(name)
 
-    tqdm.pandas(desc="Detecting language [tokens=%s]..." % file_path.split("_")[3])
-    df["lang"] = df["comment"].progress_apply(detect)
+        print(f"Detecting language [{name}]...")
+        df["lang"] = detect_languages(df["comment"].tolist())
+        write_preprocessed(df)
 
-    for token_count in [100, 75, 50, 25, 10, 1]:
-        save_path = f"{YOUTUBE_DATA_DIR}/data_preprocessed_{token_count}_tokens.pkl"
-            
+    for token_count in TOKEN_THRESHOLDS:
         df_filtered = df[df["token_count"] >= token_count]
-        # df_filtered = df_filtered.drop(columns=["token_count"])      
-        df_filtered.to_pickle(save_path)
-
         create_language_distribution(token=token_count, df=df_filtered)
 
 if __name__ == "__main__":
-    # execution takes around [2h23min]
+    # execution took around [2h23min] with langdetect on a single core
     main()
\ No newline at end of file
@@ -0,0 +1,31 @@
+import pandas as pd
+from cleaner import clean_texts
+from dataset import is_current, read_dataset, write_dataset
+from language import detect_languages
+
+# the only language topic modeling keeps, see process.py
+GATE_LANGUAGE = "pt"
+
+def gate_language(df: pd.DataFrame, backend: str="langdetect") -> pd.DataFrame:
+    """Detect the language of the lightly cleaned comments and keep only the
+    ones in GATE_LANGUAGE, with the detected language in the column [lang]."""
+    df = df.reset_index(drop=True)
+    df["lang"] = detect_languages(clean_texts(df["comment"], platform="youtube"),
+                                  backend=backend)
+
+    gated = df[df["lang"] == GATE_LANGUAGE]
+    print(f"[{len(gated)}] of [{len(df)}] comments are [{GATE_LANGUAGE}] " \
+          f"({len(gated) / max(len(df), 1) * 100:.1f}%).")
+    return gated
+
+def main():
+    """Optional stage between deduplicate.py and preprocess.py, so that spaCy
+    only lemmatizes comments that survive the language filter anyway. As the
+    [lang] column then already exists, language.py leaves it as it is."""
+    name = "data_deduplicated" if is_current("data_deduplicated") \
+           else "data_filtered"
+    print(f"Gating [{name}]...")
+    write_dataset(gate_language(read_dataset(name)), "data_gated", source=name)
+
+if __name__ == "__main__":
+    main()
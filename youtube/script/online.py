@@ -0,0 +1,149 @@
+import os
+import sys
+import json
+from typing import Dict, List
+import numpy as np
+from sklearn.decomposition import IncrementalPCA
+from sklearn.cluster import MiniBatchKMeans
+from bertopic import BERTopic
+from bertopic.vectorizers import OnlineCountVectorizer
+from sentence_transformers import SentenceTransformer
+from dataset import INGESTED_COLUMN, read_preprocessed
+from embedding import encode, get_embedding_name, load_embedding_model
+from embedding_cache import EmbeddingCache
+from process import ONLINE_MODEL_FILE, YOUTUBE_DIR, get_model_backend, \
+                    get_model_dir, get_topic_info, save_model_backend
+
+# every partial_fit needs at least as many docs as there are clusters and
+# components, the comments of an update are split into batches of this size
+ONLINE_BATCH_SIZE = 10000
+ONLINE_TOPICS = 50
+ONLINE_COMPONENTS = 5
+# how much the word counts of earlier batches fade with every new one
+VECTORIZER_DECAY = 0.01
+
+def load_state(name: str) -> Dict:
+    """The ingestion time up to which the comments are in the model, see
+    dataset.INGESTED_COLUMN, and how many."""
+    state_path = f"{get_model_dir(name)}/online_state.json"
+    if not os.path.exists(state_path):
+        return {"last_ingested_at": None, "n_docs": 0}
+    with open(state_path, "r") as file:
+        return json.load(file)
+
+def save_state(name: str, state: Dict) -> None:
+    state_path = f"{get_model_dir(name)}/online_state.json"
+    with open(f"{state_path}.tmp", "w") as file:
+        json.dump(state, file, indent=4)
+    os.replace(f"{state_path}.tmp", state_path)
+
+def get_online_topic_model(embedding_model: SentenceTransformer) -> BERTopic:
+    """BERTopic whose every step can be updated with a batch of docs: PCA
+    instead of UMAP, k-means instead of HDBSCAN and a vectorizer that learns
+    new words and lets old counts decay."""
+    return BERTopic(
+        language="multilingual",
+        embedding_model=embedding_model,
+        umap_model=IncrementalPCA(n_components=ONLINE_COMPONENTS),
+        hdbscan_model=MiniBatchKMeans(n_clusters=ONLINE_TOPICS,
+                                      random_state=42,
+                                      n_init=3),
+        vectorizer_model=OnlineCountVectorizer(ngram_range=(1,1),
+                                               decay=VECTORIZER_DECAY),
+        top_n_words=10,
+        verbose=True
+    )
+
+def load_topic_model(name: str, embedding_model: SentenceTransformer) -> BERTopic:
+    model_path = f"{get_model_dir(name)}/{ONLINE_MODEL_FILE}"
+    if not os.path.exists(model_path):
+        return get_online_topic_model(embedding_model)
+    return BERTopic.load(model_path, embedding_model=embedding_model)
+
+def save_topic_model(topic_model: BERTopic, name: str) -> None:
+    """Pickle the whole model, the partial_fit steps live in the PCA, k-means
+    and vectorizer state that safetensors doesn't keep. The embedding model is
+    left out and given back on load."""
+    model_path = f"{get_model_dir(name)}/{ONLINE_MODEL_FILE}"
+    topic_model.save(f"{model_path}.tmp",
+                     serialization="pickle",
+                     save_embedding_model=False)
+    os.replace(f"{model_path}.tmp", model_path)
+
+def get_batches(n_docs: int, batch_size: int=ONLINE_BATCH_SIZE) -> List[slice]:
+    """Split into batches of <batch_size>, the remainder goes to the last
+    batch so that none is too small to fit."""
+    n_batches = max(1, n_docs // batch_size)
+    bounds = [batch * batch_size for batch in range(n_batches)] + [n_docs]
+    return [slice(start, end) for start, end in zip(bounds[:-1], bounds[1:])]
+
+def update(name: str,
+           token_count: int=10,
+           backend: str="auto") -> None:
+    """Fit the saved online model of <name> on the comments ingested since
+    the last update, of any year, at a cost that depends on their number
+    only: the row groups of earlier ingestions are skipped by their
+    statistics, see update.py for how they are appended.
+
+    The topic of every new comment is counted per day and appended to
+    <name>/online_topic_counts.csv to track the topics over time.
+    """
+    model_dir = get_model_dir(name)
+    os.makedirs(model_dir, exist_ok=True)
+    state = load_state(name)
+    # every update has to embed with the backend the model started with
+    backend = get_model_backend(name, backend)
+
+    filters = [("lang", "==", "pt")]
+    if state["last_ingested_at"] is not None:
+        filters.append((INGESTED_COLUMN, ">", state["last_ingested_at"]))
+    df = read_preprocessed(min_tokens=token_count,
+                           columns=["date", "comment", INGESTED_COLUMN],
+                           filters=filters,
+                           years=None)
+    if len(df) < ONLINE_TOPICS:
+        print(f"Only [{len(df)}] comments ingested since " \
+              f"[{state['last_ingested_at']}], at least [{ONLINE_TOPICS}] " \
+              "are needed. Closing...")
+        return
+
+    df = df.sort_values([INGESTED_COLUMN, "date"], kind="stable") \
+           .reset_index(drop=True)
+    docs = df["comment"].astype(str).tolist()
+    print(f"Updating [{name}] with [{len(docs)}] comments from " \
+          f"[{df['date'].iloc[0]}] to [{df['date'].iloc[-1]}]...")
+
+    embedding_model = load_embedding_model(backend)
+    embeddings = EmbeddingCache(get_embedding_name(backend)).get_embeddings(
+        docs, lambda texts: encode(embedding_model, texts, backend=backend)
+    )
+    topic_model = load_topic_model(name, embedding_model)
+
+    topics = np.empty(len(docs), dtype=np.int64)
+    for batch in get_batches(len(docs)):
+        topic_model.partial_fit(docs[batch], embeddings[batch])
+        topics[batch] = topic_model.topics_
+
+    save_topic_model(topic_model, name)
+    save_model_backend(name, backend)
+    get_topic_info(model_dir, topic_model)
+
+    counts_path = f"{YOUTUBE_DIR}/result/{name}/online_topic_counts.csv"
+    counts = df[["date"]].assign(topic=topics) \
+                         .groupby(["date", "topic"]).size() \
+                         .reset_index(name="count")
+    counts.to_csv(counts_path, mode="a", index=False,
+                  header=not os.path.exists(counts_path))
+
+    save_state(name, {"last_ingested_at": df[INGESTED_COLUMN].max(),
+                      "n_docs": state["n_docs"] + len(docs)})
+
+def get_online_name(token_count: int) -> str:
+    return f"data_online_{token_count}_tokens"
+
+if __name__ == "__main__":
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    # e.g. python online.py 10, run by update.py after the new comments are
+    # appended to the datasets
+    token_count = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    update(get_online_name(token_count), token_count=token_count)
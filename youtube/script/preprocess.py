@@ -1,20 +1,26 @@
 import os
-import re
-from typing import List
+import sys
+import time
 import pandas as pd
 import numpy as np
 import spacy
+from spacy.language import Language
+from spacy.tokens import Token
 from tqdm import tqdm
+from cleaner import clean_texts, tidy_texts
+from dataset import TOKEN_THRESHOLDS, dataset_exists, is_current, read_dataset, \
+                    write_preprocessed
 from stopwords import get_stopwords, get_normalized_words
 
-YOUTUBE_DATA_DIR = f"/home/{os.getlogin()}/Desktop/bachelor_thesis/youtube/data"
 STOPWORDS = get_stopwords()
+# lexeme ID => whether the word passes <is_valid_lexeme>
+VALID_LEXEMES = dict()
+# components the lemmas need, the lemmatizer of pt_core_news_lg may listen to
+# tok2vec depending on the model version
+LEMMA_PIPES = ["tok2vec", "lemmatizer", "trainable_lemmatizer"]
 
-def remove_hashtag(text: str) -> str: return re.sub('#\w+', '', text).strip()
-def remove_mention(text: str) -> str: return re.sub("@\w+", '', text).strip()
-def remove_laughter(text: str) -> str: return re.sub(r'\b[kK]+\b', '', text).strip()
-
-def is_valid_token(token: str) -> bool:
+def is_valid_lexeme(token: Token) -> bool:
+    """Checks that only depend on the word itself, not on its context."""
     return (
         not token.is_stop
         and not token.is_space
@@ -25,49 +31,126 @@ def is_valid_token(token: str) -> bool:
         and not token.like_num
         and token.is_alpha
         and token.text not in STOPWORDS
-        and len(token.lemma_) >= 3
     ) 
 
-def spacy_preprocessing(df: pd.DataFrame, docs: List[str]) -> pd.DataFrame:
-    for idx, doc in enumerate(tqdm(docs, desc="spacy_preprocessing")):
-        processed_text = [token.lemma_ for token in doc if is_valid_token(token)]
-        df.iat[idx, 3] = " ".join(processed_text) if processed_text else ""
-        
-    return df
+def is_valid_token(token: Token) -> bool:
+    """The lexeme checks are done once per vocabulary entry and cached by the
+    lexeme ID, only the lemma length is checked for every token."""
+    valid = VALID_LEXEMES.get(token.orth)
+    if valid is None:
+        valid = VALID_LEXEMES[token.orth] = is_valid_lexeme(token)
+    return valid and len(token.lemma_) >= 3
 
-def get_different_amount_of_tokens(df: pd.DataFrame) -> None:
-    df["token_count"] = df["comment"].apply(lambda x: len(x.split()))
+def get_n_process(memory_per_process: float=1.5) -> int:
+    """Return how many spaCy processes this machine can run: one per usable
+    core, but no more than fit in memory with a copy of pt_core_news_lg each.
 
-    for x in tqdm([100, 75, 50, 25, 10, 1], 
-                  desc="get_different_amount_of_tokens"):
-        df_filtered = df[df["token_count"] >= x]
-        df_filtered.to_pickle(f"{YOUTUBE_DATA_DIR}" \
-                              f"/data_preprocessed_{x}_tokens.pkl")
+    :memory_per_process: GiB needed by one process
+    """
+    if hasattr(os, "sched_getaffinity"):
+        cores = len(os.sched_getaffinity(0))
+    else:
+        cores = os.cpu_count() or 1
+    memory = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 2**30
+    return max(1, min(cores, int(memory // memory_per_process)))
 
-def main():
-    df = pd.read_pickle(f"{YOUTUBE_DATA_DIR}/data_filtered.pkl")
-    df['comment'] = df['comment'].apply(str.lower)
-    df['comment'] = df['comment'].apply(remove_hashtag)
-    df['comment'] = df['comment'].apply(remove_mention)
-    df['comment'] = df['comment'].apply(remove_laughter)
+def get_batch_size(n_texts: int, n_process: int) -> int:
+    """Give every process at least a few batches to work on, between 64 and
+    1000 comments each."""
+    return max(64, min(1000, n_texts // (n_process * 8) or 1))
 
-    # activated = spacy.prefer_gpu()        
+def load_lemmatizer() -> Language:
+    """Load pt_core_news_lg with only what the lemmas depend on enabled. The
+    lexical attributes used by <is_valid_token> come from the tokenizer and
+    the vocabulary, not from any pipeline component."""
     nlp = spacy.load("pt_core_news_lg", 
                      exclude=["tagger", "ner", "morphologizer"])     
-    docs = nlp.pipe(df["comment"], n_process=6) # if <n_process> is activated, GPU shouldn't be used in paralell as leads to conflict
-    df = spacy_preprocessing(df, docs)
+    nlp.select_pipes(disable=[pipe for pipe in nlp.pipe_names 
+                              if pipe not in LEMMA_PIPES])
+    return nlp
+
+def spacy_preprocessing(df: pd.DataFrame, 
+                        nlp: Language,
+                        n_process: int | None=None,
+                        batch_size: int | None=None) -> pd.DataFrame:
+    """Replace each comment by its valid lemmas.
+
+    The lemmas are collected in a preallocated array in the order nlp.pipe
+    returns them, which is the order of the comments, and assigned to the
+    comment column at once.
+    """
+    n_process = n_process or get_n_process()
+    batch_size = batch_size or get_batch_size(len(df), n_process)
+    lemmas = np.empty(len(df), dtype=object)
+
+    start = time.perf_counter()
+    docs = nlp.pipe(df["comment"], n_process=n_process, batch_size=batch_size)
+    for idx, doc in enumerate(tqdm(docs, total=len(df), 
+                                   desc="spacy_preprocessing")):
+        lemmas[idx] = " ".join([token.lemma_ for token in doc 
+                                if is_valid_token(token)])
+    elapsed = time.perf_counter() - start
+
+    print(f"Lemmatized [{len(df)}] comments in [{elapsed:.0f}s], " \
+          f"[{len(df) / max(elapsed, 1e-9):.0f}] comments/s with " \
+          f"n_process=[{n_process}] batch_size=[{batch_size}] " \
+          f"pipes={nlp.pipe_names}")
+
+    df["comment"] = lemmas
+    return df
+
+def save_preprocessed(df: pd.DataFrame, source: str) -> None:
+    """Save the comments once, see dataset.write_preprocessed."""
+    write_preprocessed(df, source=source)
+
+    for token_count in TOKEN_THRESHOLDS:
+        print(f"[{(df['token_count'] >= token_count).sum()}] comments with " \
+              f"at least [{token_count}] tokens.")
+
+def get_input_dataset() -> str:
+    """Return the output of the latest stage that ran before this one, the
+    language gate and the deduplication are optional. A stage output built
+    from an older version of its input is skipped, see dataset.is_current.
+    To choose the input explicitly, run with --input=<name>."""
+    for name in ["data_gated", "data_deduplicated"]:
+        if is_current(name):
+            return name
+        if dataset_exists(name):
+            print(f"[{name}] is outdated, skipping it.")
+    return "data_filtered"
+
+def preprocess(df: pd.DataFrame) -> pd.DataFrame:
+    """Clean, lemmatize and normalize the comments, drop the ones left empty
+    or repeated and count the tokens of the rest."""
+    df['comment'] = clean_texts(df['comment'], platform="youtube")
+
+    # activated = spacy.prefer_gpu()        
+    nlp = load_lemmatizer()
+    # if <n_process> > 1, GPU shouldn't be used in paralell as leads to conflict
+    df = spacy_preprocessing(df, nlp)
 
     normalized_words = get_normalized_words()
-    df['comment'] = df['comment'].replace(normalized_words, regex=True)
-    df['comment'] = df['comment'].apply(lambda x: re.sub(r'\s+', ' ', x).strip())
+    df['comment'] = tidy_texts(df['comment'], normalized_words)
     df['comment'] = df['comment'].replace('', np.nan)
     df.dropna(subset=['comment'], inplace=True)
+    if "multiplicity" in df.columns:
+        df["multiplicity"] = df.groupby("comment")["multiplicity"].transform("sum")
     df.drop_duplicates(subset="comment", keep="first", inplace=True)
-    df['comment'] = df['comment'].apply(str.lower)
     df["token_count"] = df["comment"].apply(lambda x: len(x.split()))
+    return df
 
-    get_different_amount_of_tokens(df)
+def main(name: str | None=None):
+    if name is None:
+        name = get_input_dataset()
+    elif not dataset_exists(name):
+        print(f"Dataset [{name}] doesn't exist. Closing...")
+        return
+    print(f"Preprocessing [{name}]...")
+    save_preprocessed(preprocess(read_dataset(name)), source=name)
 
 if __name__ == "__main__":
     # execution takes around 16 minutes.
-    main()
\ No newline at end of file
+    # e.g. python preprocess.py --input=data_filtered to skip the optional stages
+    options = dict(arg[2:].split("=", 1) for arg in sys.argv[1:]
+                   if arg.startswith("--") and "=" in arg)
+    main(name=options.get("input"))
\ No newline at end of file
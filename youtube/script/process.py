@@ -1,44 +1,65 @@
 import os
+import sys
+import json
 from typing import List, Tuple
-import pandas as pd
 import matplotlib.pyplot as plt
 from tqdm import tqdm
 from wordcloud import WordCloud
 from numpy import ndarray
 from sklearn.feature_extraction.text import CountVectorizer
 from sentence_transformers import SentenceTransformer
-from umap import UMAP
-from hdbscan import HDBSCAN
 from bertopic import BERTopic
 from channel_representativeness import get_channel_representativeness
+from clustering import UMAP_NEIGHBORS, get_hdbscan, get_umap
+from dataset import read_preprocessed
+from embedding import EMBEDDING_MODEL, encode, get_backend, get_embedding_name, \
+                      load_embedding_model
+from embedding_cache import EmbeddingCache
+from knn_graph import KnnGraphCache
 # conda install -c plotly plotly-orca # https://github.com/plotly/orca
 
 YOUTUBE_DIR = f"/home/{os.getlogin()}/Desktop/bachelor_thesis/youtube"
-
-def get_umap(n_neighbors=5, n_components=5, min_dist=0.0, metric="cosine", 
-             random_state=42) -> UMAP:
-    return UMAP(n_neighbors=n_neighbors,
-                n_components=n_components,
-                min_dist=min_dist,
-                metric=metric,
-                random_state=random_state)
-
-def get_hdbscan(min_cluster_size=10) -> HDBSCAN:
-    return HDBSCAN(min_cluster_size=min_cluster_size, prediction_data=True)
-
-def get_embedding_model(docs: List[str]) -> Tuple[SentenceTransformer, ndarray]:
-    embedding_model = SentenceTransformer(
-        model_name_or_path="paraphrase-multilingual-MiniLM-L12-v2", 
-        device="cuda")
-    
-    embeddings = embedding_model.encode(docs, 
-                                        show_progress_bar=True, 
-                                        batch_size=32)
+# the models of online.py are pickled into their model_dir under this name,
+# see inference.load_topic_model
+ONLINE_MODEL_FILE = "online_topic_model.pkl"
+# the embedding backend a model was trained with, see <get_model_backend>
+MODEL_BACKEND_FILE = "embedding_backend.json"
+
+def get_embedding_model(
+        docs: List[str],
+        embedding_cache: EmbeddingCache | None=None,
+        backend: str="auto"
+    ) -> Tuple[SentenceTransformer, ndarray]:
+    """Return the embedding model and the embeddings of <docs>. With an
+    <embedding_cache> only the docs it doesn't know yet are encoded.
+
+    backend: see embedding.EMBEDDING_BACKENDS, "auto" uses the GPU if there
+             is one and the int8 model on all cores otherwise
+    """
+    embedding_model = load_embedding_model(backend)
+
+    def encode_docs(texts: List[str]) -> ndarray:
+        return encode(embedding_model, texts, backend=backend)
+
+    if embedding_cache is None:
+        embeddings = encode_docs(docs)
+    else:
+        embeddings = embedding_cache.get_embeddings(docs, encode_docs)
     return embedding_model, embeddings
 
-def topic_modeling(docs: List[str]) -> BERTopic:
-    embedding_model, embeddings = get_embedding_model(docs)
-    umap_model, hdbscan_model = get_umap(), get_hdbscan()
+def topic_modeling(docs: List[str], 
+                   embedding_cache: EmbeddingCache | None=None,
+                   backend: str="auto",
+                   knn_cache: KnnGraphCache | None=None) -> BERTopic:
+    """With a <knn_cache> UMAP gets the neighbours of the docs precomputed
+    instead of searching them itself."""
+    embedding_model, embeddings = get_embedding_model(docs, embedding_cache, 
+                                                      backend)
+    precomputed_knn = (None, None, None)
+    if knn_cache is not None:
+        precomputed_knn = (*knn_cache.get(docs, embeddings, UMAP_NEIGHBORS), None)
+    umap_model, hdbscan_model = get_umap(precomputed_knn=precomputed_knn), \
+                                get_hdbscan()
     vectorizer_model = CountVectorizer(ngram_range=(1,1))
     top_n_words = 10
     nr_topics = 50
@@ -57,16 +78,43 @@ def topic_modeling(docs: List[str]) -> BERTopic:
 
     return topic_model
 
-def save_topic_model(topic_model: BERTopic, filename: str) -> None:    
-    topic_model.save(f"{YOUTUBE_DIR}/result/{filename}/model_dir",
+def get_model_dir(name: str) -> str:
+    return f"{YOUTUBE_DIR}/result/{name}/model_dir"
+
+def save_model_backend(name: str, backend: str) -> None:
+    with open(f"{get_model_dir(name)}/{MODEL_BACKEND_FILE}", "w") as file:
+        json.dump({"backend": get_backend(backend)}, file, indent=4)
+
+def get_model_backend(name: str, backend: str="auto") -> str:
+    """The embedding backend to use with the model <name>: the one it was
+    trained with for "auto", <backend> if it gives the same embeddings,
+    e.g. onnx for a torch model. Any other would assign topics to
+    embeddings the model's clusters were never fitted on."""
+    backend_path = f"{get_model_dir(name)}/{MODEL_BACKEND_FILE}"
+    if not os.path.exists(backend_path):
+        # saved before the backend was recorded, or not trained yet
+        return get_backend(backend)
+    with open(backend_path, "r") as file:
+        trained_backend = json.load(file)["backend"]
+
+    if backend == "auto":
+        return trained_backend
+    if get_embedding_name(backend) != get_embedding_name(trained_backend):
+        raise ValueError(f"[{name}] was trained on [{trained_backend}] " \
+                         f"embeddings, [{get_backend(backend)}] ones differ.")
+    return get_backend(backend)
+
+def save_topic_model(topic_model: BERTopic, filename: str, backend: str) -> None:    
+    topic_model.save(get_model_dir(filename),
                      serialization="safetensors",
                      save_ctfidf=True,
                      save_embedding_model="sentence-transformers/" \
-                                          "all-MiniLM-L6-v2")
+                                          f"{EMBEDDING_MODEL}")
+    save_model_backend(filename, backend)
 
 def get_topic_info(save_path: str, topic_model: BERTopic) -> None: 
-    topic_model.get_topic_info().to_pickle(
-        path=save_path + "/get_topic_info.pkl"
+    topic_model.get_topic_info().to_parquet(
+        path=save_path + "/get_topic_info.parquet"
     )
 
 def get_topic_word_scores(token_count: int, topic_model: BERTopic) -> None: 
@@ -123,34 +171,40 @@ def get_wordcloud(token_count: int, topic_model: BERTopic, topic: int) -> None:
                 format="svg", 
                 bbox_inches="tight")
 
-def main():
+def main(backend: str="auto"):
+    # the docs of every threshold are a subset of the 1 token docs, shared
+    # embeddings are looked up instead of encoded again
+    embedding_cache = EmbeddingCache(get_embedding_name(backend))
+    # largest doc set first, its kNN graph is stored once and restricted to
+    # the smaller thresholds
+    knn_cache = KnnGraphCache(get_embedding_name(backend))
+
     for token_count in tqdm([
-                    # 100, 
-                    75, 
-                    50, 
-                    25, 
+                    1,
                     10,
-                    1
+                    25, 
+                    50, 
+                    75, 
+                    # 100, 
                    ]
                   ):
-        filename = f"data_preprocessed_{token_count}_tokens" 
-        load_path = f"{YOUTUBE_DIR}/data/{filename}.pkl"
         result_filename = f"data_processed_{token_count}_tokens"
         save_path = f"{YOUTUBE_DIR}/result/{result_filename}/plot"
         if not os.path.exists(save_path): 
             os.makedirs(save_path)
 
-        print(f"+++++{filename}+++++")
+        print(f"+++++{result_filename}+++++")
 
-        df = pd.read_pickle(load_path)[["date", "channel", "comment", "lang"]]
-        df = df[df["lang"] == "pt"] # filter by language
+        df = read_preprocessed(min_tokens=token_count,
+                               columns=["date", "channel", "comment", "lang"],
+                               filters=[("lang", "==", "pt")]) # filter by language
 
         docs = df["comment"].astype(str).tolist()
         timestamps = df["date"].astype(str).tolist()
 
-        topic_model = topic_modeling(docs)
+        topic_model = topic_modeling(docs, embedding_cache, backend, knn_cache)
 
-        save_topic_model(topic_model, result_filename)
+        save_topic_model(topic_model, result_filename, backend)
 
         get_topic_info(save_path, topic_model)
         get_topic_word_scores(token_count, topic_model)
@@ -165,4 +219,7 @@ def main():
                                        topic_model=topic_model)
 if __name__ == "__main__":
     os.environ["TOKENIZERS_PARALLELISM"] = "false"
-    main()
\ No newline at end of file
+    # e.g. python process.py --backend=onnx
+    backends = [arg.split("=", 1)[1] for arg in sys.argv 
+                if arg.startswith("--backend=")]
+    main(backend=backends[-1] if backends else "auto")
\ No newline at end of file
@@ -2,14 +2,23 @@
 # Source: https://pypi.org/project/leia-br/
 import os
 import sys
-from typing import Dict, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 from tqdm import tqdm
 from LeIA import SentimentIntensityAnalyzer
+from dataset import PREPROCESSED_DATASET, TOKEN_THRESHOLDS, get_dataset_columns, \
+                    read_dataset, write_preprocessed
 
-YOUTUBE_DATA_DIR = f"/home/{os.getlogin()}/Desktop/bachelor_thesis/youtube/data"
-SIA = SentimentIntensityAnalyzer()
+SENTIMENT_COLUMNS = ["neg", "neu", "pos", "compound"]
+# loaded once per worker process by <init_sentiment_worker>
+SIA = None
+
+def init_sentiment_worker() -> None:
+    global SIA
+    SIA = SentimentIntensityAnalyzer()
 
 def detect_sentiment(text: str) -> Dict[str, float]: 
     """Return a dict containing the sentiment values [neg, neu, pos, compound]
@@ -21,32 +30,60 @@ def detect_sentiment(text: str) -> Dict[str, float]:
         'compound': -0.9062
     }
     """
+    if SIA is None:
+        init_sentiment_worker()
     return SIA.polarity_scores(text)
 
-def process_sentiment(file_path: str, df: pd.DataFrame) -> None:
-    """
-    Calculate the sentiment, append it to the original DataFrame and save it
-    in the same original file, overwritting/replacing it.
-
-    file_path: full path of the .pkl file
+def score_chunk(texts: List[str]) -> np.ndarray:
+    """Return the sentiment values of the texts as rows of SENTIMENT_COLUMNS."""
+    scores = np.empty((len(texts), len(SENTIMENT_COLUMNS)), dtype=np.float32)
+    for idx, text in enumerate(texts):
+        polarity = detect_sentiment(text)
+        scores[idx] = [polarity[column] for column in SENTIMENT_COLUMNS]
+    return scores
+
+def process_sentiment(name: str, 
+                      df: pd.DataFrame, 
+                      n_process: int | None=None,
+                      chunk_size: int=5000) -> pd.DataFrame:
     """
-    tqdm.pandas(desc="Detecting sentiment [tokens=%s]..." % file_path.split("_")[3])
-    df_sentiment = df['comment'].progress_apply(detect_sentiment)
+    Calculate the sentiment and append it to the original DataFrame.
 
-    sentiment_df = pd.DataFrame(df_sentiment.tolist())
+    The comments are scored in chunks on <n_process> processes (all cores by
+    default), each loading the LeIA lexicon once. The scores are written
+    straight into float32 columns.
 
-    df_sent = df.reset_index(drop=True, inplace=True)
-    df_sent = pd.concat([df, sentiment_df], axis=1)
-    # df_sent.to_pickle(file_path)
+    name: name of the dataset the DataFrame was read from
+    """
+    texts = df['comment'].tolist()
+    chunks = [texts[start:start + chunk_size] 
+              for start in range(0, len(texts), chunk_size)]
+    scores = np.empty((len(texts), len(SENTIMENT_COLUMNS)), dtype=np.float32)
+
+    with ProcessPoolExecutor(max_workers=n_process, 
+                             initializer=init_sentiment_worker) as executor:
+        results = executor.map(score_chunk, chunks)
+        for start, chunk_scores in zip(
+            tqdm(range(0, len(texts), chunk_size), 
+                 desc=f"Detecting sentiment [{name}]..."),
+            results
+        ):
+            scores[start:start + len(chunk_scores)] = chunk_scores
+
+    df_sent = df.reset_index(drop=True)
+    for idx, column in enumerate(SENTIMENT_COLUMNS):
+        df_sent[column] = scores[:, idx]
 
     return df_sent
 
 def calculate_sentiment_counts(df: pd.DataFrame) -> Tuple[int, int, int]:
-    sent_pos = df[df['compound'] >= 0.05]
-    sent_neg = df[df['compound'] <= -0.05]
-    sent_neu = df[(df['compound'] > -0.05) & (df['compound'] < 0.05)]
+    """Count positive, negative and neutral comments in one pass over the
+    compound scores."""
+    compound = df['compound'].to_numpy()
+    labels = np.where(compound >= 0.05, 0, np.where(compound <= -0.05, 1, 2))
+    sent_pos, sent_neg, sent_neu = np.bincount(labels, minlength=3)
 
-    return len(sent_pos), len(sent_neg), len(sent_neu)
+    return int(sent_pos), int(sent_neg), int(sent_neu)
 
 def create_sentiment_visualization(token_count: int, df: pd.DataFrame) -> None:
     file_path = f"/home/{os.getlogin()}/Desktop/bachelor_thesis" \
@@ -73,22 +110,21 @@ def create_sentiment_visualization(token_count: int, df: pd.DataFrame) -> None:
     # plt.show()
 
 def main():
-    file_path = f"{YOUTUBE_DATA_DIR}/data_preprocessed_1_tokens.pkl"
-    df = pd.read_pickle(file_path)
+    name = PREPROCESSED_DATASET
 
-    if "neg" and "neu" and "pos" and "compound" in df.columns.tolist():
+    if set(SENTIMENT_COLUMNS) <= set(get_dataset_columns(name)):
         print("Columns [neg, neu, pos, compound] already exist. Closing...")
         sys.exit()
 
-    df_sent = process_sentiment(file_path, df)
+    df = read_dataset(name)
+    df_sent = process_sentiment(name, df)
+    write_preprocessed(df_sent)
     
-    for token_count in [100, 75, 50, 25, 10, 1]:
-        df_filtered = df_sent[df_sent["token_count"] >= token_count]
-        # df_filtered = df_filtered.drop(columns=["token_count"])      
-        df_filtered.to_pickle(f"{YOUTUBE_DATA_DIR}/data_preprocessed_{token_count}_tokens.pkl")
-        df_filtered = df_filtered[df_filtered["lang"] == "pt"]
+    for token_count in TOKEN_THRESHOLDS:
+        df_filtered = df_sent[(df_sent["token_count"] >= token_count) 
+                              & (df_sent["lang"] == "pt")]
         create_sentiment_visualization(token_count=token_count, df=df_filtered)
 
 if __name__ == "__main__":
-    # execution takes around 3 minutes [2:48]
+    # execution took around 3 minutes [2:48] on a single core
     main()
\ No newline at end of file
@@ -0,0 +1,259 @@
+import os
+import re
+import sys
+import json
+import zlib
+import gzip
+import hashlib
+import threading
+from typing import Dict, Iterator, List
+
+YOUTUBE_STORE_DIR = f"/home/{os.getlogin()}/Desktop/bachelor_thesis/youtube/data/store"
+SHARD_SUFFIX = ".jsonl.gz"
+GZIP_MAGIC = b"\x1f\x8b\x08"
+SHARD_COUNT = 64
+SHARD_NAME = re.compile(r"videos-[0-9a-f]{2}")
+
+_append_lock = threading.Lock()
+
+def get_video_id(video_info: Dict) -> str:
+    return video_info["video_url"].strip().split("=")[-1]
+
+def get_shard_name(video_info: Dict) -> str:
+    """Return the shard a video belongs to, picked by a hash of its video id
+    so that every record of a video lands in the same shard, whatever its
+    channel title is at the time."""
+    digest = hashlib.blake2b(get_video_id(video_info).encode("utf-8"),
+                             digest_size=8).digest()
+    return f"videos-{int.from_bytes(digest, 'big') % SHARD_COUNT:02x}"
+
+def is_legacy_shard(filename: str) -> bool:
+    """Shards used to be named after the channel title, which may be empty or
+    change between runs, see <reshard_store>."""
+    return not SHARD_NAME.fullmatch(filename[:-len(SHARD_SUFFIX)])
+
+def get_shard_path(video_info: Dict, store_dir: str=YOUTUBE_STORE_DIR) -> str:
+    return f"{store_dir}/{get_shard_name(video_info)}{SHARD_SUFFIX}"
+
+def append_record(record: Dict, shard_path: str) -> None:
+    """Append one record to a shard as its own gzip member.
+
+    The whole member is compressed in memory and handed to a single write on a
+    file opened with O_APPEND, followed by fsync. A crash can therefore leave
+    at most one truncated member at the end of the shard, which is skipped by
+    <iter_shard>. Nothing that was already stored is ever rewritten.
+    """
+    line = json.dumps(record, ensure_ascii=False) + "\n"
+    member = gzip.compress(line.encode("utf-8"))
+
+    with _append_lock:
+        os.makedirs(os.path.dirname(shard_path), exist_ok=True)
+        fd = os.open(shard_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, member)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+def save_video(video_info: Dict, store_dir: str=YOUTUBE_STORE_DIR) -> None:
+    """Append the extracted comments of one video to the store."""
+    print("Saving comments to store... ", end="")
+    append_record(video_info, get_shard_path(video_info, store_dir))
+    print("OK")
+
+def iter_shard(shard_path: str, chunk_size: int=1 << 20) -> Iterator[Dict]:
+    """Yield the records of a shard one at a time.
+
+    Members are decompressed one after another. A member that is corrupt or
+    cut short by a crash is dropped and reading resumes at the next gzip
+    header, so one bad append doesn't hide the records written after it.
+    """
+    buffer = b""
+    eof = False
+    need_more = True
+
+    with open(shard_path, "rb") as file:
+        while True:
+            if need_more and not eof:
+                chunk = file.read(chunk_size)
+                eof = not chunk
+                buffer += chunk
+            if not buffer:
+                return
+
+            decompressor = zlib.decompressobj(wbits=31)
+            try:
+                data = decompressor.decompress(buffer)
+            except zlib.error:
+                data = None
+
+            if data is not None and decompressor.eof:
+                buffer = decompressor.unused_data
+                need_more = len(buffer) < len(GZIP_MAGIC)
+                for line in data.decode("utf-8").splitlines():
+                    if line:
+                        yield json.loads(line)
+            elif data is not None and not eof:
+                # the member continues past the buffer
+                need_more = True
+            else:
+                # corrupt or truncated member, skip to the next header
+                position = buffer.find(GZIP_MAGIC, 1)
+                buffer = buffer[position:] if position != -1 else b""
+                need_more = not buffer
+
+def iter_records(store_dir: str=YOUTUBE_STORE_DIR) -> Iterator[Dict]:
+    """Yield every record of the store, shard by shard."""
+    if not os.path.isdir(store_dir):
+        return
+
+    for filename in sorted(os.listdir(store_dir)):
+        if filename.endswith(SHARD_SUFFIX):
+            yield from iter_shard(f"{store_dir}/{filename}")
+
+def get_comment_key(comment: Dict):
+    """Records stored before the ids were kept fall back to date and text."""
+    return comment.get("comment_id") or (comment["comment_published_at"],
+                                         comment["comment_text_display"])
+
+def get_reply_key(reply: Dict):
+    return reply.get("reply_id") or (reply["reply_published_at"],
+                                     reply["reply_text_display"])
+
+def get_row_id(video_info: Dict, *keys) -> str:
+    """Id of a comment from its <get_comment_key>, or of a reply from those of
+    its comment and itself: its own id where it was stored, otherwise a hash of
+    the video id and the keys, the same for every import of the record."""
+    if isinstance(keys[-1], str):
+        return keys[-1]
+    digest = hashlib.blake2b(json.dumps([get_video_id(video_info), *keys])
+                                 .encode("utf-8"), digest_size=16)
+    return f"legacy-{digest.hexdigest()}"
+
+def merge_video(video: Dict, record: Dict) -> None:
+    """Merge the comments and replies of <record> into <video> by their ids."""
+    for key in ["video_channel_title", "video_published_at", "video_title"]:
+        video[key] = video.get(key) or record.get(key, "")
+
+    comments = {get_comment_key(comment): comment 
+                for comment in video["video_comment"]}
+
+    for comment in record["video_comment"]:
+        stored = comments.get(get_comment_key(comment))
+        if stored is None:
+            comments[get_comment_key(comment)] = comment
+            video["video_comment"].append(comment)
+            continue
+
+        replies = {get_reply_key(reply) for reply in stored["comment_reply"]}
+        for reply in comment["comment_reply"]:
+            if get_reply_key(reply) not in replies:
+                replies.add(get_reply_key(reply))
+                stored["comment_reply"].append(reply)
+
+def get_shard_filenames(store_dir: str) -> List[str]:
+    return sorted(filename for filename in os.listdir(store_dir)
+                  if filename.endswith(SHARD_SUFFIX))
+
+def iter_videos(store_dir: str=YOUTUBE_STORE_DIR) -> Iterator[Dict]:
+    """Yield every video of the store once.
+
+    A refresh appends a record with only the new comments of a video, and
+    the same video may have been crawled more than once. Records of the same
+    video share a shard, so they are merged shard by shard and only one
+    shard is held in memory at a time. A store that still has shards named
+    after channels is merged as a whole instead.
+    """
+    if not os.path.isdir(store_dir):
+        return
+
+    filenames = get_shard_filenames(store_dir)
+    if any(is_legacy_shard(filename) for filename in filenames):
+        print(f"[{store_dir}] has shards named after channels, merging all " \
+              "of them in memory. Run storage.py --reshard once to fix it.")
+        filenames = [filenames]
+    else:
+        filenames = [[filename] for filename in filenames]
+
+    for group in filenames:
+        videos = dict()
+        for filename in group:
+            for record in iter_shard(f"{store_dir}/{filename}"):
+                video_id = get_video_id(record)
+                if video_id not in videos:
+                    videos[video_id] = record
+                else:
+                    merge_video(videos[video_id], record)
+        yield from videos.values()
+
+def reshard_store(store_dir: str=YOUTUBE_STORE_DIR) -> None:
+    """Move the records of shards named after channels into the shards of
+    their video ids. Each legacy shard is removed only after all its records
+    were appended, a crash in between duplicates records, which
+    <iter_videos> merges."""
+    for filename in get_shard_filenames(store_dir):
+        if is_legacy_shard(filename):
+            for record in iter_shard(f"{store_dir}/{filename}"):
+                append_record(record, get_shard_path(record, store_dir))
+            os.remove(f"{store_dir}/{filename}")
+            print(f"Resharded [{filename}].")
+
+def get_latest_comment_dates(store_dir: str=YOUTUBE_STORE_DIR) -> Dict[str, str]:
+    """Return the publishedAt of the newest comment thread stored per video."""
+    latest = dict()
+    for record in iter_records(store_dir):
+        for comment in record["video_comment"]:
+            published_at = comment["comment_published_at"]
+            if published_at > latest.get(record["video_url"], ""):
+                latest[record["video_url"]] = published_at
+    return latest
+
+def iter_json_array(filename: str, chunk_size: int=1 << 20) -> Iterator[Dict]:
+    """Yield the elements of a top-level JSON array without loading the whole
+    file into memory."""
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    started = False
+
+    with open(filename, "r") as file:
+        while True:
+            chunk = file.read(chunk_size)
+            buffer = buffer[position:] + chunk
+            position = 0
+
+            while True:
+                while position < len(buffer) and buffer[position] in " \t\r\n,":
+                    position += 1
+                if not started and position < len(buffer):
+                    if buffer[position] != "[":
+                        raise ValueError(f"{filename} does not contain a JSON array.")
+                    started = True
+                    position += 1
+                    continue
+                if position < len(buffer) and buffer[position] == "]":
+                    return
+                try:
+                    element, position = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    break
+                yield element
+
+            if not chunk:
+                if buffer[position:].strip():
+                    raise ValueError(f"{filename} ended in the middle of an element.")
+                return
+
+def import_json_file(filename: str, store_dir: str=YOUTUBE_STORE_DIR) -> None:
+    """Move the videos of the old data.json into the store."""
+    count = 0
+    for video_info in iter_json_array(filename):
+        append_record(video_info, get_shard_path(video_info, store_dir))
+        count += 1
+    print(f"Successfully imported [{count}] videos into [{store_dir}].")
+
+if __name__ == "__main__":
+    if "--reshard" in sys.argv:
+        reshard_store()
+    else:
+        import_json_file(f"/home/{os.getlogin()}/Desktop/bachelor_thesis/youtube/data/data.json")
@@ -0,0 +1,109 @@
+import os
+import sys
+import hashlib
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+from dataset import read_preprocessed
+from embedding_cache import EmbeddingCache, save_array
+from sweep_worker import PROJECTION_CACHE_DIR, cluster_projection, fit_projection
+
+# spawned workers import this module again as __mp_main__, so the embedding
+# model and with it torch are only imported inside <main>
+YOUTUBE_DIR = f"/home/{os.getlogin()}/Desktop/bachelor_thesis/youtube"
+SWEEP_RESULT_DIR = f"{YOUTUBE_DIR}/result/sweep"
+
+# every UMAP setting is fitted once and clustered with every HDBSCAN setting
+UMAP_GRID = {
+    "n_neighbors": [5, 15, 30],
+    "n_components": [5, 10],
+    "min_dist": [0.0],
+}
+HDBSCAN_GRID = {
+    "min_cluster_size": [10, 25, 50, 100],
+    "min_samples": [None, 5],
+}
+
+def get_grid(grid: Dict[str, List]) -> List[Dict]:
+    return [dict(zip(grid, values)) for values in itertools.product(*grid.values())]
+
+def get_array_hash(array: np.ndarray) -> str:
+    digest = hashlib.blake2b(str(array.shape).encode("utf-8"), digest_size=16)
+    digest.update(np.ascontiguousarray(array).data)
+    return digest.hexdigest()
+
+def sweep(embeddings: np.ndarray,
+          umap_grid: Dict[str, List]=UMAP_GRID,
+          hdbscan_grid: Dict[str, List]=HDBSCAN_GRID,
+          n_process: int | None=None) -> pd.DataFrame:
+    """Fit every UMAP setting of <umap_grid> and cluster every projection
+    with every HDBSCAN setting of <hdbscan_grid>, both grids spread over
+    <n_process> processes. The workers read the embeddings and projections
+    from disk, memory-mapped, instead of receiving copies."""
+    os.makedirs(PROJECTION_CACHE_DIR, exist_ok=True)
+    embeddings_path = f"{PROJECTION_CACHE_DIR}/{get_array_hash(embeddings)}.npy"
+    if not os.path.exists(embeddings_path):
+        save_array(embeddings_path, embeddings)
+
+    umap_points = get_grid(umap_grid)
+    hdbscan_points = get_grid(hdbscan_grid)
+
+    # UMAP with a random_state runs on a single thread, so the grid points
+    # are what is parallelized
+    with ProcessPoolExecutor(max_workers=n_process,
+                             mp_context=multiprocessing.get_context("spawn")
+                             ) as executor:
+        projection_paths = list(tqdm(
+            executor.map(fit_projection,
+                         [embeddings_path] * len(umap_points), umap_points),
+            total=len(umap_points), desc="UMAP"
+        ))
+
+        points = list(itertools.product(range(len(umap_points)), hdbscan_points))
+        metrics = list(tqdm(
+            executor.map(cluster_projection,
+                         [projection_paths[umap_idx] for umap_idx, _ in points],
+                         [hdbscan_params for _, hdbscan_params in points]),
+            total=len(points), desc="HDBSCAN"
+        ))
+
+    rows = [{**{f"umap_{key}": value for key, value in umap_points[umap_idx].items()},
+             **{f"hdbscan_{key}": value for key, value in hdbscan_params.items()},
+             **point_metrics}
+            for (umap_idx, hdbscan_params), point_metrics in zip(points, metrics)]
+    return pd.DataFrame(rows)
+
+def main(token_count: int=10, backend: str="auto"):
+    from embedding import encode, get_embedding_name, load_embedding_model
+
+    df = read_preprocessed(min_tokens=token_count,
+                           columns=["comment"],
+                           filters=[("lang", "==", "pt")])
+    docs = df["comment"].astype(str).tolist()
+
+    embedding_model = load_embedding_model(backend)
+    embeddings = EmbeddingCache(get_embedding_name(backend)).get_embeddings(
+        docs, lambda texts: encode(embedding_model, texts, backend=backend)
+    )
+    del embedding_model
+
+    results = sweep(embeddings)
+    results.insert(0, "token_count", token_count)
+
+    os.makedirs(SWEEP_RESULT_DIR, exist_ok=True)
+    results.to_csv(f"{SWEEP_RESULT_DIR}/sweep_{token_count}_tokens.csv",
+                   index=False)
+    print(f"[{(~results['valid']).sum()}] of [{len(results)}] configs are " \
+          "invalid, e.g. all noise.")
+    print(results[results["valid"]].sort_values("relative_validity", ascending=False)
+                                   .head(10).to_string(index=False))
+
+if __name__ == "__main__":
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    # e.g. python sweep.py 25 int8
+    main(token_count=int(sys.argv[1]) if len(sys.argv) > 1 else 10,
+         backend=sys.argv[2] if len(sys.argv) > 2 else "auto")
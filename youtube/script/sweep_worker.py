@@ -0,0 +1,76 @@
+import os
+from typing import Dict
+import numpy as np
+from sklearn.metrics import silhouette_score
+from clustering import get_hdbscan, get_umap
+from embedding_cache import save_array
+
+# what the spawned sweep processes import, keep it free of BERTopic and torch
+
+YOUTUBE_DATA_DIR = f"/home/{os.getlogin()}/Desktop/bachelor_thesis/youtube/data"
+PROJECTION_CACHE_DIR = f"{YOUTUBE_DATA_DIR}/umap_cache"
+SILHOUETTE_SAMPLE_SIZE = 10000
+
+def get_params_name(params: Dict) -> str:
+    return "-".join(f"{key}={value}" for key, value in sorted(params.items()))
+
+def get_projection_path(embeddings_hash: str, umap_params: Dict) -> str:
+    return f"{PROJECTION_CACHE_DIR}/{embeddings_hash}-" \
+           f"{get_params_name(umap_params)}.npy"
+
+def fit_projection(embeddings_path: str, umap_params: Dict) -> str:
+    """Reduce the embeddings with UMAP unless the projection for these
+    embeddings and settings is cached already, return where it's stored."""
+    embeddings_hash = os.path.basename(embeddings_path)[:-len(".npy")]
+    projection_path = get_projection_path(embeddings_hash, umap_params)
+    if not os.path.exists(projection_path):
+        embeddings = np.load(embeddings_path, mmap_mode="r")
+        projection = get_umap(**umap_params).fit_transform(embeddings)
+        save_array(projection_path, projection.astype(np.float32))
+    return projection_path
+
+def get_relative_validity(hdbscan_model) -> float:
+    """relative_validity_ of a fitted HDBSCAN, NaN where hdbscan can't
+    compute it, e.g. it divides by zero or takes the max of no clusters
+    when everything is noise."""
+    try:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            relative_validity = float(hdbscan_model.relative_validity_)
+    except (ValueError, ZeroDivisionError, IndexError, KeyError):
+        return np.nan
+    return relative_validity if np.isfinite(relative_validity) else np.nan
+
+def cluster_projection(projection_path: str, hdbscan_params: Dict) -> Dict:
+    """Cluster a cached projection and measure the clustering.
+
+    valid: whether there are at least two clusters and a relative validity,
+           the other configs can't be compared and are ranked last
+    relative_validity: DBCV approximation of HDBSCAN, higher is better
+    silhouette: on a sample of the clustered points, noise left out
+    """
+    projection = np.load(projection_path)
+    hdbscan_model = get_hdbscan(**hdbscan_params).set_params(gen_min_span_tree=True)
+    labels = hdbscan_model.fit_predict(projection)
+
+    clustered = np.flatnonzero(labels >= 0)
+    n_clusters = len(np.unique(labels[clustered]))
+    silhouette = np.nan
+    relative_validity = np.nan
+    if n_clusters > 1:
+        silhouette = silhouette_score(projection[clustered], labels[clustered],
+                                      sample_size=min(SILHOUETTE_SAMPLE_SIZE,
+                                                      len(clustered)),
+                                      random_state=42)
+        relative_validity = get_relative_validity(hdbscan_model)
+
+    return {
+        "valid": n_clusters > 1 and not np.isnan(relative_validity),
+        "n_clusters": n_clusters,
+        "noise_ratio": 1 - len(clustered) / len(labels),
+        "largest_cluster_ratio": np.bincount(labels[clustered]).max() / len(labels)
+                                 if n_clusters else np.nan,
+        "mean_probability": hdbscan_model.probabilities_[clustered].mean()
+                            if n_clusters else np.nan,
+        "relative_validity": relative_validity,
+        "silhouette": silhouette,
+    }
@@ -0,0 +1,79 @@
+import os
+import sys
+from typing import List
+import pandas as pd
+from dataset import INGESTED_COLUMN, PREPROCESSED_DATASET, get_dataset_columns, \
+                    get_dataset_info, get_ingestion_time, is_current, \
+                    write_dataset, write_preprocessed
+from deduplicate import deduplicate
+from filter import append_new_comments, can_update
+from language import detect_languages
+from language_gate import gate_language
+from online import get_online_name, update
+from preprocess import preprocess
+from sentiment import SENTIMENT_COLUMNS, process_sentiment
+
+# the optional stages between data_filtered and data_preprocessed
+STAGES = {
+    "data_deduplicated": deduplicate,
+    "data_gated": gate_language,
+}
+
+def get_source_chain(name: str) -> List[str]:
+    """The datasets <name> was built from, data_filtered first."""
+    chain = list()
+    source = get_dataset_info(name)["source"]
+    while source is not None:
+        chain.insert(0, source)
+        source = get_dataset_info(source)["source"]
+    return chain
+
+def append_new_rows(df: pd.DataFrame, chain: List[str]) -> None:
+    """Run the new rows of data_filtered through the stages of <chain> and
+    the preprocessing, appending them to each dataset. The stages only see
+    these rows, e.g. a new comment is deduplicated against the other new
+    ones, not against the corpus."""
+    for name, source in zip(chain[1:], chain[:-1]):
+        if len(df):
+            df = STAGES[name](df)
+        write_dataset(df, name, append=True, source=source)
+
+    if not len(df):
+        write_dataset(df, PREPROCESSED_DATASET, append=True, source=chain[-1])
+        return
+    df = preprocess(df)
+    columns = get_dataset_columns(PREPROCESSED_DATASET)
+    if "lang" in columns and "lang" not in df.columns:
+        df["lang"] = detect_languages(df["comment"].tolist())
+    if set(SENTIMENT_COLUMNS) <= set(columns):
+        df = process_sentiment(PREPROCESSED_DATASET, df)
+    write_preprocessed(df, source=chain[-1], append=True)
+
+def main(token_count: int=10) -> None:
+    """Daily update after extract.py --refresh: append the comments the store
+    gained to data_filtered and every stage after it, with the time of this
+    update in [ingested_at], and fit the online model on them. Every step
+    only reads and writes the new rows."""
+    if not can_update():
+        print("[data_filtered] has no comment ids or ingestion times, run " \
+              "filter.py and the stages after it once. Closing...")
+        return
+    if not is_current(PREPROCESSED_DATASET) \
+       or INGESTED_COLUMN not in get_dataset_columns(PREPROCESSED_DATASET):
+        print(f"[{PREPROCESSED_DATASET}] wasn't built from the current " \
+              "[data_filtered], run the stages after filter.py once. Closing...")
+        return
+
+    chain = get_source_chain(PREPROCESSED_DATASET)
+    print(f"Appending the new comments to {chain + [PREPROCESSED_DATASET]}...")
+    df = append_new_comments(get_ingestion_time())
+    print(f"[{len(df)}] new comments.")
+    if len(df):
+        append_new_rows(df, chain)
+
+    update(get_online_name(token_count), token_count=token_count)
+
+if __name__ == "__main__":
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    # e.g. python update.py 10, once a day after python extract.py --refresh
+    main(token_count=int(sys.argv[1]) if len(sys.argv) > 1 else 10)
@@ -0,0 +1,8 @@
+import os
+import sys
+import getpass
+
+# the scripts import each other by module name and build their data paths
+# from os.getlogin(), which fails without a controlling terminal
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "script"))
+os.getlogin = getpass.getuser
@@ -0,0 +1,141 @@
+import gzip
+import json
+import time
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+from urllib.parse import urlparse, parse_qs
+
+def get_reply_count(thread_index: int, replies_per_thread: int) -> int:
+    """Every other thread has no replies, every tenth one has more replies
+    than fit on one page of the comments endpoint."""
+    if thread_index % 10 == 0:
+        return 120
+    return replies_per_thread if thread_index % 2 == 0 else 0
+
+def get_fake_video(video_id: str="fake",
+                   number_of_threads: int=500,
+                   replies_per_thread: int=3) -> Dict:
+    """Return a synthetic video with the shape of the API responses."""
+    threads = list()
+    for i in range(number_of_threads):
+        replies = [
+            {
+                'id': f'{video_id}.t{i}.r{j}',
+                'snippet': {
+                    'textDisplay': f'reply {j} to comment {i}',
+                    'publishedAt': f'2021-01-01T00:{j % 60:02d}:00Z',
+                    'parentId': f'{video_id}.t{i}',
+                },
+            }
+            for j in range(get_reply_count(i, replies_per_thread))
+        ]
+        threads.append({
+            'id': f'{video_id}.t{i}',
+            'snippet': {
+                'totalReplyCount': len(replies),
+                'topLevelComment': {
+                    'id': f'{video_id}.t{i}',
+                    'snippet': {
+                        'textDisplay': f'comment {i}',
+                        'publishedAt': f'2021-01-01T{i // 60 % 24:02d}:{i % 60:02d}:00Z',
+                    },
+                },
+            },
+            'replies': replies,
+        })
+
+    return {
+        'id': video_id,
+        'snippet': {
+            'publishedAt': '2021-01-01T00:00:00Z',
+            'title': f'Video {video_id}',
+            'channelTitle': 'Fake Channel',
+        },
+        'threads': threads,
+    }
+
+def get_page(items: List, params: Dict, default_size: int) -> Dict:
+    size = int(params.get('maxResults', [default_size])[0])
+    start = int(params.get('pageToken', ['0'])[0])
+    page = {'items': items[start:start + size]}
+    if start + size < len(items):
+        page['nextPageToken'] = str(start + size)
+    return page
+
+def get_handler(video: Dict, latency: float, error_rate: float):
+    threads = {thread['id']: thread for thread in video['threads']}
+    # the API embeds at most five replies per thread
+    max_inline_replies = 5
+
+    class FakeYouTubeHandler(BaseHTTPRequestHandler):
+        """Answer videos, commentThreads and comments requests for one video
+        after sleeping <latency> seconds, like a remote server would. A share
+        of <error_rate> requests fails with 503."""
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            time.sleep(latency)
+            if random.random() < error_rate:
+                self.send_response(503)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+
+            url = urlparse(self.path)
+            resource = url.path.rstrip('/').split('/')[-1]
+            params = parse_qs(url.query)
+
+            if resource == 'videos':
+                body = {'items': [{'snippet': video['snippet']}]}
+            elif resource == 'commentThreads':
+                ordered = video['threads']
+                if params.get('order', [''])[0] == 'time':
+                    ordered = sorted(ordered, reverse=True, key=lambda thread: 
+                                     thread['snippet']['topLevelComment']
+                                           ['snippet']['publishedAt'])
+                body = get_page(ordered, params, 20)
+                inline = 'replies' in params.get('part', [''])[0].split(',')
+                body['items'] = [
+                    {'id': thread['id'], 
+                     'snippet': thread['snippet'],
+                     **({'replies': {'comments': thread['replies'][:max_inline_replies]}}
+                        if inline and thread['replies'] else {})}
+                    for thread in body['items']
+                ]
+            elif resource == 'comments':
+                thread = threads[params['parentId'][0]]
+                body = get_page(thread['replies'], params, 20)
+            else:
+                self.send_error(404)
+                return
+
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            if 'gzip' in self.headers.get('Accept-Encoding', ''):
+                data = gzip.compress(data)
+                self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return FakeYouTubeHandler
+
+class FakeYouTubeServer(ThreadingHTTPServer):
+    request_queue_size = 128
+    daemon_threads = True
+
+def start_fake_api(video: Dict, 
+                   latency: float=0.05, 
+                   error_rate: float=0.0) -> FakeYouTubeServer:
+    """Serve <video> on a free local port in a background thread. The base
+    URL to pass to the extractor is http://127.0.0.1:<port>."""
+    server = FakeYouTubeServer(('127.0.0.1', 0), 
+                               get_handler(video, latency, error_rate))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
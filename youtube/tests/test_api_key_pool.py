@@ -0,0 +1,65 @@
+import json
+from io import BytesIO
+from queue import Queue
+from urllib.error import HTTPError
+import pytest
+import extract
+from api_key_pool import ApiKeyPool, QuotaExceeded
+
+def get_pool(tmp_path, daily_quota=10):
+    return ApiKeyPool(["key-a", "key-b"], daily_quota=daily_quota, reserve=0,
+                      usage_file=str(tmp_path / "quota.json"))
+
+def get_http_error(code, reason):
+    body = json.dumps({"error": {"code": code, "errors": [{"reason": reason}]}})
+    return HTTPError("url", code, "error", {}, BytesIO(body.encode("utf-8")))
+
+def run_worker(monkeypatch, pool, results):
+    """Run one worker over two videos, get_youtube_comments answers with
+    <results> in order."""
+    results = iter(results)
+    monkeypatch.setattr(extract, "get_youtube_comments",
+                        lambda *args, **kwargs: next(results))
+    monkeypatch.setattr(extract, "set_video_as_visited", lambda *args: None)
+    monkeypatch.setattr(extract, "delete_checkpoint", lambda *args: None)
+    monkeypatch.setattr(extract, "save_video", lambda *args: None)
+
+    video_queue = Queue()
+    for video_url in ["video-1", "video-2"]:
+        video_queue.put(video_url)
+    extract.extraction_worker("key-a", pool, video_queue)
+    return video_queue
+
+def test_key_is_retired_once_its_quota_is_spent(tmp_path):
+    pool = get_pool(tmp_path)
+    for _ in range(10):
+        pool.spend("key-a", "commentThreads")
+    with pytest.raises(QuotaExceeded):
+        pool.spend("key-a", "commentThreads")
+
+    assert pool.get_live_keys() == ["key-b"]
+    pool.save()
+    assert get_pool(tmp_path).get_live_keys() == ["key-b"]
+
+def test_quota_403_retires_the_key_and_requeues_the_video(tmp_path, monkeypatch):
+    pool = get_pool(tmp_path)
+    video_queue = run_worker(monkeypatch, pool, [403])
+
+    assert not pool.is_live("key-a")
+    assert sorted(video_queue.queue) == ["video-1", "video-2"]
+
+def test_unreadable_video_is_skipped_without_retiring(tmp_path, monkeypatch):
+    pool = get_pool(tmp_path)
+    video_queue = run_worker(monkeypatch, pool, [None, None])
+
+    assert pool.is_live("key-a")
+    assert video_queue.empty()
+
+def test_get_error_reason():
+    assert extract.get_error_reason(get_http_error(403, "quotaExceeded")) \
+           in extract.QUOTA_REASONS
+    assert extract.get_error_reason(get_http_error(403, "commentsDisabled")) \
+           not in extract.QUOTA_REASONS
+    assert extract.get_error_reason(
+        HTTPError("url", 403, "error", {}, BytesIO(b"<html>"))
+    ) is None
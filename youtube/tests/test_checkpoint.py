@@ -0,0 +1,44 @@
+import json
+import extract
+
+def get_page(page_token, comment_ids):
+    return {"page_token": page_token,
+            "comments": [{"comment_id": comment_id, "comment_reply": []}
+                         for comment_id in comment_ids]}
+
+def test_resume_after_a_line_cut_short(tmp_path, monkeypatch):
+    monkeypatch.setattr(extract, "CHECKPOINT_DIR", str(tmp_path))
+    extract.save_checkpoint("video", "token-2", get_page(None, ["1", "2"])["comments"])
+    # crash in the middle of the second page
+    line = json.dumps(get_page("token-3", ["3", "4"]))
+    with open(extract.get_checkpoint_path("video"), "a") as file:
+        file.write(line[:len(line) // 2])
+
+    checkpoint = extract.load_checkpoint("video")
+    assert checkpoint["page_token"] == "token-2"
+    assert [comment["comment_id"] for comment in checkpoint["comments"]] == ["1", "2"]
+
+    # the page is fetched again and appended to a clean file
+    extract.save_checkpoint("video", "token-3", get_page(None, ["3", "4"])["comments"])
+    checkpoint = extract.load_checkpoint("video")
+    assert checkpoint["page_token"] == "token-3"
+    assert [comment["comment_id"] for comment in checkpoint["comments"]] == \
+           ["1", "2", "3", "4"]
+
+def test_pages_after_a_broken_line_are_kept(tmp_path, monkeypatch):
+    """Checkpoints written before broken lines were removed: the page fetched
+    again sits on the broken line and was appended a second time later."""
+    monkeypatch.setattr(extract, "CHECKPOINT_DIR", str(tmp_path))
+    first = json.dumps(get_page("token-2", ["1"]))
+    second = json.dumps(get_page("token-3", ["2"]))
+    third = json.dumps(get_page("token-4", ["3"]))
+    with open(extract.get_checkpoint_path("video"), "w") as file:
+        file.write(first + "\n" + second[:10] + second + "\n" + second + "\n" 
+                   + third + "\n")
+
+    checkpoint = extract.load_checkpoint("video")
+    assert checkpoint["page_token"] == "token-4"
+    assert [comment["comment_id"] for comment in checkpoint["comments"]] == \
+           ["1", "2", "3"]
+    with open(extract.get_checkpoint_path("video")) as file:
+        assert all(json.loads(line) for line in file)
@@ -0,0 +1,27 @@
+import re
+import random
+import pytest
+from cleaner import clean_texts
+
+# the substitutions preprocess.py ran one after another before cleaner.py
+SEQUENTIAL_RULES = {
+    "youtube": [r"#\w+", r"@\w+", r"\b[kK]+\b"],
+    "instagram": [r"#\w+", r"@\w+", r"(ha)+|(k)+"],
+}
+PIECES = ["#", "@", "k", "K", "kk", "ha", "h", "a", "vacina", "é", "_", "-",
+          " ", "  ", "\n", ".", "!", "1"]
+
+def clean_sequentially(text, platform):
+    text = text.lower()
+    for pattern in SEQUENTIAL_RULES[platform]:
+        text = re.sub(pattern, "", text).strip()
+    return text
+
+@pytest.mark.parametrize("platform", ["youtube", "instagram"])
+def test_single_pass_matches_sequential_rules(platform):
+    generator = random.Random(0)
+    texts = ["".join(generator.choices(PIECES, k=generator.randint(0, 12)))
+             for _ in range(20000)]
+
+    for text, cleaned in zip(texts, clean_texts(texts, platform)):
+        assert cleaned.split() == clean_sequentially(text, platform).split(), text
@@ -0,0 +1,90 @@
+import pandas as pd
+import pyarrow.parquet as pq
+import dataset
+from dataset import is_current, write_dataset
+
+def get_comments(comments):
+    return pd.DataFrame({"url": "a", "channel": "Canal Butantan",
+                         "date": "2021-01-02", "comment": comments})
+
+def test_rebuilt_source_outdates_its_outputs(tmp_path, monkeypatch):
+    monkeypatch.setattr(dataset, "YOUTUBE_DATA_DIR", str(tmp_path))
+    write_dataset(get_comments(["1", "1"]), "data_filtered")
+    write_dataset(get_comments(["1"]), "data_deduplicated", source="data_filtered")
+    write_dataset(get_comments(["1"]), "data_gated", source="data_deduplicated")
+    assert is_current("data_deduplicated") and is_current("data_gated")
+
+    write_dataset(get_comments(["2"]), "data_filtered", append=True)
+    assert is_current("data_filtered")
+    assert not is_current("data_deduplicated")
+    assert not is_current("data_gated")
+    assert len(dataset.read_dataset("data_filtered")) == 3
+
+def test_preprocessed_row_groups_are_sorted_by_token_count(tmp_path, monkeypatch):
+    monkeypatch.setattr(dataset, "YOUTUBE_DATA_DIR", str(tmp_path))
+    monkeypatch.setattr(dataset, "PREPROCESSED_ROW_GROUP_SIZE", 100)
+    df = get_comments([str(i) for i in range(1000)])
+    df["token_count"] = [(i * 37) % 120 for i in range(1000)]
+    dataset.write_preprocessed(df, source="data_filtered")
+
+    ranges = []
+    for path in (tmp_path / dataset.PREPROCESSED_DATASET).rglob("*.parquet"):
+        metadata = pq.ParquetFile(path).metadata
+        column = metadata.schema.names.index("token_count")
+        ranges += [(metadata.row_group(group).column(column).statistics.min,
+                    metadata.row_group(group).column(column).statistics.max)
+                   for group in range(metadata.num_row_groups)]
+    assert len(ranges) == 10
+    # longest first, so every threshold is a prefix of the row groups
+    assert all(previous_min >= next_max for (previous_min, _), (_, next_max)
+               in zip(ranges[:-1], ranges[1:]))
+    assert len(dataset.read_preprocessed(min_tokens=100)) == \
+           (df["token_count"] >= 100).sum()
+
+def test_appending_every_stage_keeps_them_current(tmp_path, monkeypatch):
+    monkeypatch.setattr(dataset, "YOUTUBE_DATA_DIR", str(tmp_path))
+    write_dataset(get_comments(["1"]).assign(ingested_at="2026-01-01T00:00:00"),
+                  "data_filtered")
+    write_dataset(get_comments(["1"]).assign(ingested_at="2026-01-01T00:00:00"),
+                  "data_deduplicated", source="data_filtered")
+
+    new = get_comments(["2"]).assign(date="2026-01-02",
+                                     ingested_at="2026-01-02T00:00:00")
+    write_dataset(new, "data_filtered", append=True)
+    assert not is_current("data_deduplicated")
+    write_dataset(new, "data_deduplicated", append=True, source="data_filtered")
+    assert is_current("data_deduplicated")
+
+    # only the rows of the last ingestion, whatever their year
+    df = dataset.read_dataset("data_deduplicated",
+                              filters=[("ingested_at", ">", "2026-01-01T00:00:00")])
+    assert df["comment"].tolist() == ["2"]
+
+def test_iter_dataset_gives_every_row_once_in_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(dataset, "YOUTUBE_DATA_DIR", str(tmp_path))
+    df = get_comments([str(i) for i in range(250)])
+    df["date"] = ["2020-01-01", "2021-01-01"] * 125
+    write_dataset(df, "data_filtered")
+
+    batches = list(dataset.iter_dataset("data_filtered", columns=["comment"],
+                                        filters=[("year", "==", "2021")],
+                                        batch_size=40))
+    assert all(len(batch) >= 40 for batch in batches[:-1])
+    assert sorted(int(comment) for batch in batches
+                  for comment in batch["comment"]) == list(range(1, 250, 2))
+
+def test_adding_columns_keeps_an_outdated_dataset_outdated(tmp_path, monkeypatch):
+    monkeypatch.setattr(dataset, "YOUTUBE_DATA_DIR", str(tmp_path))
+    write_dataset(get_comments(["1"]), "data_filtered")
+    dataset.write_preprocessed(get_comments(["1"]).assign(token_count=1),
+                               source="data_filtered")
+    assert is_current(dataset.PREPROCESSED_DATASET)
+
+    write_dataset(get_comments(["2"]), "data_filtered")
+    assert not is_current(dataset.PREPROCESSED_DATASET)
+    # e.g. language.py adding [lang]
+    df = dataset.read_dataset(dataset.PREPROCESSED_DATASET)
+    dataset.write_preprocessed(df.assign(lang="pt"))
+    assert not is_current(dataset.PREPROCESSED_DATASET)
+    assert dataset.get_dataset_info(dataset.PREPROCESSED_DATASET)["source"] == \
+           "data_filtered"
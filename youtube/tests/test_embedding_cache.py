@@ -0,0 +1,16 @@
+import numpy as np
+from embedding_cache import EmbeddingCache
+
+def encode(texts):
+    return np.array([[len(text), 1.0, 2.0] for text in texts],
+                    dtype=np.float32).reshape(len(texts), 3)
+
+def test_no_texts_give_the_embedding_dimension(tmp_path):
+    cache = EmbeddingCache("model", cache_dir=str(tmp_path))
+    assert cache.get_embeddings([], encode).shape == (0, 3)
+
+    cache.get_embeddings(["a", "bb"], encode)
+    cache = EmbeddingCache("model", cache_dir=str(tmp_path))
+    assert cache.get_embeddings([], lambda texts: 1 / 0).shape == (0, 3)
+    assert cache.get_embeddings(["bb", "a"], lambda texts: 1 / 0)[:, 0].tolist() == \
+           [2.0, 1.0]
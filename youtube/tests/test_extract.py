@@ -0,0 +1,55 @@
+import pytest
+import api
+import extract
+from fake_api import get_fake_video, get_reply_count, start_fake_api
+
+NUMBER_OF_THREADS = 120
+
+@pytest.fixture(autouse=True)
+def no_checkpoints_no_backoff(tmp_path, monkeypatch):
+    monkeypatch.setattr(extract, "CHECKPOINT_DIR", str(tmp_path))
+    monkeypatch.setattr(api.YouTubeClient, "sleep_before_retry",
+                        lambda self, attempt: None)
+
+@pytest.fixture
+def fake_api(request):
+    server = start_fake_api(get_fake_video(number_of_threads=NUMBER_OF_THREADS),
+                            latency=0.0, error_rate=getattr(request, "param", 0.0))
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+def get_comments(base_url, max_workers, inline_replies=True, newer_than=None):
+    # a client per test, the fake server of an earlier one is gone
+    video_info = extract.get_youtube_comments(
+        "https://www.youtube.com/watch?v=fake", api_key=base_url,
+        max_workers=max_workers, inline_replies=inline_replies,
+        newer_than=newer_than, base_url=base_url
+    )
+    return video_info["video_comment"]
+
+def assert_complete(comments, thread_indices):
+    assert [comment["comment_id"] for comment in comments] == \
+           [f"fake.t{idx}" for idx in thread_indices]
+    for idx, comment in zip(thread_indices, comments):
+        assert [reply["reply_id"] for reply in comment["comment_reply"]] == \
+               [f"fake.t{idx}.r{j}" for j in range(get_reply_count(idx, 3))]
+
+@pytest.mark.parametrize("max_workers", [1, 8])
+@pytest.mark.parametrize("inline_replies", [False, True])
+def test_every_thread_and_reply(fake_api, max_workers, inline_replies):
+    # every tenth thread has 120 replies, one page more than the API gives
+    comments = get_comments(fake_api, max_workers, inline_replies)
+    assert_complete(comments, range(NUMBER_OF_THREADS))
+
+@pytest.mark.parametrize("fake_api", [0.2], indirect=True)
+@pytest.mark.parametrize("max_workers", [1, 8])
+def test_503_answers_are_retried(fake_api, max_workers):
+    assert_complete(get_comments(fake_api, max_workers), range(NUMBER_OF_THREADS))
+
+@pytest.mark.parametrize("max_workers", [1, 8])
+def test_newer_than_stops_at_the_stored_threads(fake_api, max_workers):
+    # thread i is published at minute i, newest first
+    comments = get_comments(fake_api, max_workers,
+                            newer_than="2021-01-01T01:30:00Z")
+    assert_complete(comments, range(NUMBER_OF_THREADS - 1, 90, -1))
@@ -0,0 +1,42 @@
+import dataset
+import filter
+from dataset import read_dataset
+
+def get_video(comments):
+    return {
+        "video_url": "https://www.youtube.com/watch?v=a",
+        "video_channel_title": "Canal Butantan",
+        "video_published_at": "2021-01-01T00:00:00Z",
+        "video_title": "title",
+        "video_comment": comments,
+    }
+
+def get_legacy_comment(idx, replies=()):
+    """A comment imported from the old data.json, without any ids."""
+    return {"comment_text_display": f"text {idx}",
+            "comment_published_at": f"2021-01-02T00:{idx:02d}:00Z",
+            "comment_reply": [{"reply_text_display": f"reply {reply}",
+                               "reply_published_at": "2021-01-03T00:00:00Z"}
+                              for reply in replies]}
+
+def test_records_without_ids_are_filtered_and_updated(tmp_path, monkeypatch):
+    monkeypatch.setattr(dataset, "YOUTUBE_DATA_DIR", str(tmp_path))
+    monkeypatch.setattr(filter, "MIN_VIDEO_COMMENTS", 1)
+    comments = [get_legacy_comment(idx, replies=[0]) for idx in range(3)]
+    comments.append({**get_legacy_comment(3), "comment_id": "c3"})
+    monkeypatch.setattr(filter, "iter_videos", lambda: iter([get_video(comments)]))
+
+    filter.main()
+    df = read_dataset("data_filtered")
+    assert len(df) == 7 and df["comment_id"].is_unique
+    assert "c3" in df["comment_id"].tolist()
+
+    # a new reply to an old thread, posted the same day as stored ones
+    comments[0]["comment_reply"].append(
+        {"reply_text_display": "reply 1",
+         "reply_published_at": "2021-01-03T00:00:00Z"}
+    )
+    new = filter.append_new_comments("2026-01-01T00:00:00")
+    assert new["comment"].tolist() == ["reply 1"]
+    assert filter.append_new_comments("2026-01-02T00:00:00").empty
+    assert len(read_dataset("data_filtered")) == 8
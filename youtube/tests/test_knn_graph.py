@@ -0,0 +1,56 @@
+import sys
+import types
+import importlib
+import numpy as np
+import pytest
+
+@pytest.fixture
+def knn_graph(monkeypatch):
+    # umap is only needed to build a graph, which the exact search stands in
+    # for here
+    umap_ = types.ModuleType("umap.umap_")
+    umap_.nearest_neighbors = None
+    monkeypatch.setitem(sys.modules, "umap", types.ModuleType("umap"))
+    monkeypatch.setitem(sys.modules, "umap.umap_", umap_)
+    monkeypatch.delitem(sys.modules, "knn_graph", raising=False)
+    knn_graph = importlib.import_module("knn_graph")
+
+    def build_knn_graph(embeddings, n_neighbors):
+        return knn_graph.search_exact(embeddings, np.arange(len(embeddings)),
+                                      n_neighbors)
+    monkeypatch.setattr(knn_graph, "build_knn_graph", build_knn_graph)
+    yield knn_graph
+    sys.modules.pop("knn_graph", None)
+
+def test_restricting_an_exact_graph_gives_the_exact_graph_of_the_subset(
+        tmp_path, knn_graph, monkeypatch):
+    rng = np.random.default_rng(42)
+    embeddings = rng.normal(size=(300, 16)).astype(np.float32)
+    texts = [f"comment {idx}" for idx in range(len(embeddings))]
+    cache = knn_graph.KnnGraphCache("model", cache_dir=str(tmp_path))
+    cache.get(texts, embeddings, n_neighbors=5)
+    assert len(cache.keys) == len(texts)
+
+    # a subset with many rows whose stored neighbours are mostly left out
+    subset = rng.choice(len(texts), size=60, replace=False)
+    monkeypatch.setattr(knn_graph, "MAX_RECOMPUTE_RATIO", 1.0)
+    monkeypatch.setattr(knn_graph, "build_knn_graph", None)
+    indices, distances = knn_graph.KnnGraphCache("model", cache_dir=str(tmp_path)) \
+                                  .get([texts[idx] for idx in subset],
+                                       embeddings[subset], n_neighbors=5)
+
+    expected_indices, expected_distances = knn_graph.search_exact(
+        embeddings[subset], np.arange(len(subset)), 5
+    )
+    assert (indices == expected_indices).all()
+    assert np.allclose(distances, expected_distances, atol=1e-5)
+
+def test_search_exact_chunks_give_the_same_neighbours(knn_graph):
+    rng = np.random.default_rng(0)
+    embeddings = rng.normal(size=(200, 8)).astype(np.float32)
+    rows = np.arange(0, 200, 3)
+    assert knn_graph.get_chunk_size(1000, memory=12 * 1000 * 7) == 7
+    single = knn_graph.search_exact(embeddings, rows, 4, chunk_size=len(rows))
+    chunked = knn_graph.search_exact(embeddings, rows, 4, chunk_size=7)
+    assert (single[0] == chunked[0]).all()
+    assert (single[0][:, 0] == rows).all()
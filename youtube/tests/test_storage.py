@@ -0,0 +1,65 @@
+import os
+from storage import append_record, get_shard_path, iter_shard, iter_videos, \
+                    reshard_store
+
+def get_video(video_url, comment_ids, channel="Canal Butantan"):
+    return {
+        "video_url": video_url,
+        "video_channel_title": channel,
+        "video_published_at": "2021-01-01T00:00:00Z",
+        "video_title": "title",
+        "video_comment": [
+            {"comment_id": comment_id,
+             "comment_text_display": f"text {comment_id}",
+             "comment_published_at": "2021-01-02T00:00:00Z",
+             "comment_reply": []}
+            for comment_id in comment_ids
+        ],
+    }
+
+def test_iter_shard_skips_truncated_member(tmp_path):
+    shard_path = get_shard_path(get_video("a", []), str(tmp_path))
+    append_record(get_video("a", ["1"]), shard_path)
+    append_record(get_video("b", ["2"]), shard_path)
+    # a crash in the middle of an append leaves half a member behind
+    with open(shard_path, "rb") as file:
+        data = file.read()
+    with open(shard_path, "ab") as file:
+        file.write(data[:len(data) // 4])
+    append_record(get_video("c", ["3"]), shard_path)
+
+    assert [record["video_url"] for record in iter_shard(shard_path)] == \
+           ["a", "b", "c"]
+
+def test_iter_videos_merges_records_of_a_video(tmp_path):
+    store_dir = str(tmp_path)
+    for record in [get_video("a", ["1", "2"]), get_video("a", ["2", "3"])]:
+        append_record(record, get_shard_path(record, store_dir))
+
+    videos = list(iter_videos(store_dir))
+    assert len(videos) == 1
+    assert [comment["comment_id"] for comment in videos[0]["video_comment"]] \
+           == ["1", "2", "3"]
+
+def test_channel_title_does_not_split_a_video(tmp_path):
+    store_dir = str(tmp_path)
+    for record in [get_video("a", ["1"]), get_video("a", ["2"], channel=""),
+                   get_video("a", ["3"], channel="Butantan")]:
+        append_record(record, get_shard_path(record, store_dir))
+
+    videos = list(iter_videos(store_dir))
+    assert len(videos) == 1
+    assert len(videos[0]["video_comment"]) == 3
+
+def test_reshard_merges_legacy_channel_shards(tmp_path):
+    store_dir = str(tmp_path)
+    append_record(get_video("a", ["1"]), f"{store_dir}/Canal_Butantan.jsonl.gz")
+    append_record(get_video("a", ["2"]), f"{store_dir}/unknown.jsonl.gz")
+    assert len(list(iter_videos(store_dir))) == 1
+
+    reshard_store(store_dir)
+    assert os.listdir(store_dir) == [os.path.basename(
+        get_shard_path(get_video("a", []), store_dir))]
+    videos = list(iter_videos(store_dir))
+    assert len(videos) == 1
+    assert len(videos[0]["video_comment"]) == 2